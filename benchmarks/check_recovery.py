@@ -0,0 +1,113 @@
+# -----------------------------------------------------------------------------
+# Copyright (C) 2024 - M. Cilento
+#
+# Title: Offline check of the recovery of the logs processing
+# Date of creation: oct-2026
+#
+# Description:
+#   Process synthetic logs (see fixtures.py) on FakeWorksheet (see fakes.py)
+#   in batches, as process_logs_in_db does, and kill the run between the flush
+#   of the rank and the mark of the logs (RankSession.commit). Then complete it
+#   with recover_processing, killed once more before the mark and run again:
+#   rank and logs worksheets must equal the ones of an uninterrupted run (no
+#   attendance counted twice, no log left unprocessed).
+#   Run "python benchmarks/check_recovery.py [num_logs] [batch_size]"
+#
+# -----------------------------------------------------------------------------
+
+
+### IMPORTING
+import os, sys, logging
+
+MODULE_DIR = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+SW_DIR=os.path.dirname(MODULE_DIR)
+sys.path.insert(0,SW_DIR)
+sys.path.insert(0,MODULE_DIR)
+from fakes import FakeSpreadsheet
+from run_benchmarks import make_history, use_spreadsheet, TMP_DIR
+from database.database import RankDataBase, LogDataBase, Checkpoint, PROCESSING_JOURNAL, recover_processing
+
+
+### GLOBALS
+NUM_LOGS = 30       # synthetic logs processed
+BATCH_SIZE = 10     # logs per RankSession, the run is killed at the second one
+
+
+### METHODS
+class Killed(Exception):
+    # the process killed (crash, Ctrl-C) in the middle of the processing
+    pass
+
+def kill_before_mark(self,logs:list):
+    raise Killed()
+
+def load_logs(logs):
+    LogDataBase().append_logs([(log.datetime_str,log.title,log.owner,log.code,log.url,
+                                log.get_attendees().str) for log in logs])
+
+def process_batch(logs,journal:Checkpoint):
+    # as process_logs_in_db: one session per batch, committed with its logs
+    session = RankDataBase().start_session()
+    for log in logs:
+        for trial_closed in log.trials_closed.list:
+            session.update(trial_closed.usernames_list_of_str,trial_closed.name,log.datetime_str)
+        session.update_attendees(log.attendees.list_of_str,log.trials_closed.num)
+    session.commit([(log.url,log.status,log.trials_closed.str) for log in logs],journal=journal)
+
+def run(logs,batch_size=BATCH_SIZE,kill_at=None):
+    # rank and logs worksheets after processing all the logs, killed at the batch kill_at and recovered
+    spreadsheet = FakeSpreadsheet()
+    use_spreadsheet(spreadsheet)
+    journal = Checkpoint(PROCESSING_JOURNAL,data_dir=TMP_DIR)
+    journal.clear()
+    load_logs(logs)
+    for num,start in enumerate(range(0,len(logs),batch_size)):
+        if num == kill_at:
+            mark_processed_logs = LogDataBase.mark_processed_logs
+            LogDataBase.mark_processed_logs = kill_before_mark
+            try:
+                process_batch(logs[start:start+batch_size],journal)
+                raise AssertionError('run not killed')
+            except Killed:
+                pass
+            try:
+                recover_processing(journal) # killed again, after the rewrite of the rank
+                raise AssertionError('recovery not killed')
+            except Killed:
+                pass
+            LogDataBase.mark_processed_logs = mark_processed_logs
+            recovered = recover_processing(journal)
+            assert recovered == len(logs[start:start+batch_size]), f'{recovered} logs recovered'
+            assert recover_processing(journal) == 0, 'journal not cleared'
+            continue
+        process_batch(logs[start:start+batch_size],journal)
+    return spreadsheet.worksheet('rank').get_all_values(), spreadsheet.worksheet('logs').get_all_values()
+
+def check_recovery(num_logs=NUM_LOGS,batch_size=BATCH_SIZE):
+    print(f'\n* Recovery of the processing ({num_logs} logs, batches of {batch_size}, killed between flush and mark)')
+    logs = make_history(num_logs)
+    rank, log_rows = run(logs,batch_size)
+    rank_recovered, log_rows_recovered = run(logs,batch_size,kill_at=1)
+    ok = True
+    if rank_recovered != rank:
+        print('  FAIL: recovered rank differs from the uninterrupted one')
+        ok = False
+    if log_rows_recovered != log_rows:
+        print('  FAIL: recovered logs worksheet differs from the uninterrupted one')
+        ok = False
+    if any(row[5] != 'Y' for row in log_rows_recovered[1:]):
+        print('  FAIL: logs left unprocessed')
+        ok = False
+    if ok:
+        print(f'  OK: rank of {len(rank)-1} users and {len(log_rows)-1} logs as in the uninterrupted run')
+    return ok
+
+
+### MAIN
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.ERROR)
+    args = sys.argv
+    num_logs = int(args[1]) if len(args) > 1 else NUM_LOGS
+    batch_size = int(args[2]) if len(args) > 2 else BATCH_SIZE
+    sys.exit(0 if check_recovery(num_logs,batch_size) else 1)
@@ -0,0 +1,113 @@
+# -----------------------------------------------------------------------------
+# Copyright (C) 2024 - M. Cilento
+#
+# Title: Offline stand-ins for google sheet and esologs
+# Date of creation: oct-2026
+#
+# Description:
+#   FakeWorksheet is an in-memory gspread-like worksheet (same interface of
+#   LocalWorksheet, on a ':memory:' sqlite storage): every API call is counted
+#   and may sleep a configurable latency, as a google sheet round trip.
+#   Like gspread worksheets it has no version, so the snapshots of database.py
+#   behave as with the 'sheets' backend.
+#   FakeESOlogsClient serves report fixtures in place of esologs.com.
+#
+# -----------------------------------------------------------------------------
+
+
+### IMPORTING
+import os, sys, time, json, threading, functools
+from collections import Counter
+
+MODULE_DIR = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+SW_DIR=os.path.dirname(MODULE_DIR)
+sys.path.insert(0,SW_DIR)
+from database.local_storage import LocalStorage, LocalWorksheet
+from database.database import WORKSHEET_HEADERS
+from gspread import Cell
+
+
+### CLASSES
+class FakeWorksheet(LocalWorksheet):
+
+    api_methods = ('get_all_values','get_all_records','row_values','col_values','cell','find',
+                   'update_cell','update_cells','batch_update','insert_row','insert_cols',
+                   'append_row','append_rows')
+    version = None # as gspread worksheets
+
+    def __init__(self,title,storage:LocalStorage=None,latency=0.):
+        super().__init__(title,storage or LocalStorage(':memory:'))
+        self.spreadsheet_id = f'fake-{id(self)}'
+        self.latency = latency  # s - per API call
+        self.num_calls = Counter()
+        self.depth = 0          # calls among methods of the worksheet are not API calls
+
+    def reset_calls(self):
+        self.num_calls = Counter()
+
+def api_call(name):
+    method = getattr(LocalWorksheet,name)
+    @functools.wraps(method)
+    def wrapper(self,*args,**kwargs):
+        if self.depth == 0:
+            self.num_calls[name] += 1
+            if self.latency:
+                time.sleep(self.latency)
+        self.depth += 1
+        try:
+            return method(self,*args,**kwargs)
+        finally:
+            self.depth -= 1
+    return wrapper
+
+for name in FakeWorksheet.api_methods:
+    setattr(FakeWorksheet,name,api_call(name))
+
+class FakeSpreadsheet:
+
+    def __init__(self,latency=0.):
+        self.storage = LocalStorage(':memory:')
+        self.worksheets = {}
+        for title,header in WORKSHEET_HEADERS.items():
+            ws = self.worksheet(title)
+            ws.update_cells([Cell(row=1,col=i+1,value=a) for i,a in enumerate(header)])
+            ws.latency = latency
+            ws.reset_calls()
+
+    def worksheet(self,title):
+        # one handle per worksheet, to be given to database.open_worksheet
+        if title not in self.worksheets:
+            self.worksheets[title] = FakeWorksheet(title,self.storage)
+        return self.worksheets[title]
+
+    @property
+    def num_calls(self):
+        return sum((a.num_calls for a in self.worksheets.values()),Counter())
+
+class FakeResponse:
+
+    def __init__(self,status_code,content=b''):
+        self.status_code = status_code
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+class FakeESOlogsClient:
+
+    def __init__(self,fixtures:dict,latency=0.):
+        self.fixtures = fixtures    # code -> json bytes
+        self.latency = latency      # s - per request
+        self.num_requests = 0
+        self.lock = threading.Lock()
+
+    def get(self,url,**kwargs):
+        # url as https://www.esologs.com/v1/report/fights/{code}?api_key=...
+        with self.lock:
+            self.num_requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        code = url.split('/')[-1].split('?')[0]
+        if code in self.fixtures:
+            return FakeResponse(200,self.fixtures[code])
+        return FakeResponse(404)
@@ -0,0 +1,137 @@
+# -----------------------------------------------------------------------------
+# Copyright (C) 2024 - M. Cilento
+#
+# Title: Report fixtures for the benchmarks
+# Date of creation: oct-2026
+#
+# Description:
+#   /v1/report/fights payloads used by the benchmarks, without esologs calls.
+#   Synthetic reports (small evening logs up to 12-hour progression logs) are
+#   generated deterministically, with the real trial names and final bosses of
+#   esologs/trials.json. Real reports can be recorded in benchmarks/fixtures
+#   (esologs API key required) and are benchmarked as well:
+#       python benchmarks/fixtures.py record https://www.esologs.com/reports/<code>
+#
+# -----------------------------------------------------------------------------
+
+
+### IMPORTING
+import os, sys, json, random
+
+
+### GLOBALS
+# Directories
+MODULE_DIR = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+SW_DIR=os.path.dirname(MODULE_DIR)
+FIXTURES_DIR=os.path.join(MODULE_DIR,'fixtures')
+
+# Synthetic reports: name -> hours of log
+SYNTHETIC_REPORTS = {'small-1h': 1,
+                     'medium-3h': 3,
+                     'long-6h': 6,
+                     'progression-12h': 12}
+TRASH_PULLS_PER_HOUR = 25
+RUN_DURATION = 1.5 # h - one trial run
+PLAYER_CLASSES = ['DragonKnight','Arcanist','Templar','Nightblade','Sorcerer','Warden','Necromancer']
+DIFFICULTY_IDS = [120,121,122,123,124,125]
+
+
+### METHODS
+def get_trials():
+    # trials analyzed (esologs/trials.json), as zones with their final boss
+    sys.path.insert(0,SW_DIR)
+    from esologs.esologs_parser import Zone, TRIALS_JSON_PATH
+    return [Zone(a['name']) for a in Zone.load_json(TRIALS_JSON_PATH)]
+
+def make_report(hours,num_players=12,guild_size=60,seed=0):
+    """
+    Synthetic /report/fights json of a log of the given hours: trash pulls,
+    boss wipes and kills of some trial runs, players (from a guild of
+    guild_size members) swapping in the roster, pets and other not-human
+    friendlies.
+    """
+    rnd = random.Random(seed)
+    trials = get_trials()
+    fights = []
+    time_ms = 0
+    for run in range(max(1,round(hours/RUN_DURATION))):
+        trial = rnd.choice(trials)
+        difficulty = rnd.choice(DIFFICULTY_IDS)
+        bosses = [(100+10*run+i,f'Boss {i+1}') for i in range(rnd.randint(2,4))]
+        bosses.append((trial.final_boss_id,trial.final_boss_name))
+        for boss_id,boss_name in bosses:
+            for i in range(round(TRASH_PULLS_PER_HOUR*RUN_DURATION/len(bosses))):
+                fights.append({'id':len(fights)+1,'start_time':time_ms,'end_time':time_ms+40000,
+                               'boss':0,'name':'Trash','size':12})
+                time_ms += 60000
+            wipes = rnd.randint(0,6 if difficulty >= 122 else 2)
+            for i in range(wipes+1):
+                kill = i == wipes and rnd.random() < 0.9
+                fights.append({'id':len(fights)+1,'start_time':time_ms,'end_time':time_ms+240000,
+                               'boss':boss_id,'name':boss_name,'zoneName':trial.name,'size':12,
+                               'difficulty':difficulty,'kill':kill,
+                               'bossPercentage':0 if kill else rnd.randint(100,9000),
+                               'fightPercentage':0 if kill else rnd.randint(100,9000)})
+                time_ms += 300000
+    friendlies = []
+    members = rnd.sample(range(guild_size),num_players+num_players//2)
+    roster, bench = members[:num_players], members[num_players:]
+    blocks = [fights[i:i+40] for i in range(0,len(fights),40)]
+    attendance = {a:[] for a in roster+bench}
+    for block in blocks:
+        if bench and rnd.random() < 0.3: # somebody leaves, somebody joins
+            i = rnd.randrange(len(roster))
+            roster[i], bench[0] = bench[0], roster[i]
+            bench.append(bench.pop(0))
+        for player in roster:
+            attendance[player] += [{'id':a['id']} for a in block]
+    for player,player_fights in attendance.items():
+        if player_fights:
+            friendlies.append({'name':f'Player {player}','id':player+1,'guid':1000+player,
+                               'type':PLAYER_CLASSES[player%len(PLAYER_CLASSES)],'icon':'Class',
+                               'anonymous':False,'displayName':f'@player{player}',
+                               'fights':player_fights})
+    for pet in range(num_players*3):
+        friendlies.append({'name':f'Pet {pet}','id':10000+pet,'guid':20000+pet,'type':'Pet','icon':'Pet',
+                           'fights':[{'id':a['id']} for a in fights if rnd.random() < 0.5]})
+    start = 1700000000000 + seed*86400000
+    return {'fights':fights,'friendlies':friendlies,'enemies':[],
+            'title':f'Synthetic {hours}h log','owner':'benchmarks',
+            'start':start,'end':start+time_ms,'zone':-1}
+
+def load_fixtures():
+    # name -> json bytes (as served by esologs) of the synthetic and of the recorded reports
+    fixtures = {name:json.dumps(make_report(hours,seed=i)).encode()
+                for i,(name,hours) in enumerate(SYNTHETIC_REPORTS.items())}
+    if os.path.isdir(FIXTURES_DIR):
+        for filename in sorted(os.listdir(FIXTURES_DIR)):
+            if filename.endswith('.json'):
+                with open(os.path.join(FIXTURES_DIR,filename),'rb') as f:
+                    fixtures[filename[:-5]] = f.read()
+    return fixtures
+
+def record_fixture(url):
+    # save the /report/fights json of a real log in FIXTURES_DIR
+    sys.path.insert(0,SW_DIR)
+    from esologs.esologs_parser import Log
+    log = Log(url,use_cache=False)
+    if not log.is_valid:
+        print(f'Log not recorded: {log.status}')
+        return
+    os.makedirs(FIXTURES_DIR,exist_ok=True)
+    path = os.path.join(FIXTURES_DIR,f'{log.code}.json')
+    with open(path,'w',encoding='utf-8') as f:
+        json.dump(log.json,f)
+    print(f'Log recorded in {path}')
+
+
+### MAIN
+if __name__ == '__main__':
+
+    args = sys.argv
+    if len(args) == 3 and args[1] == 'record':
+        record_fixture(args[2])
+    else:
+        for name,payload in load_fixtures().items():
+            report = json.loads(payload)
+            print(f"{name}: {len(report['fights'])} fights, {len(report['friendlies'])} friendlies, {len(payload)/1e3:.0f} kB")
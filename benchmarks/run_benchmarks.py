@@ -0,0 +1,159 @@
+# -----------------------------------------------------------------------------
+# Copyright (C) 2024 - M. Cilento
+#
+# Title: Offline benchmarks of the hot paths
+# Date of creation: oct-2026
+#
+# Description:
+#   Time the pipeline without esologs and google credentials: report fixtures
+#   (see fixtures.py) are served by FakeESOlogsClient and the databases run on
+#   FakeWorksheet (see fakes.py), with an optional latency per sheet call.
+#   Measured: parse throughput (json -> Log -> calculate_trials_closed), rank
+#   update cost (incremental, per-log and rebuild) and API calls per log of
+#   load_logs_from_file + process_logs_in_db (the functions of main.py).
+#   Run "python benchmarks/run_benchmarks.py [num_logs] [sheet_latency_s]"
+#
+# -----------------------------------------------------------------------------
+
+
+### IMPORTING
+import os, sys, time, json, logging, tempfile, functools
+
+MODULE_DIR = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+SW_DIR=os.path.dirname(MODULE_DIR)
+sys.path.insert(0,SW_DIR)
+sys.path.insert(0,MODULE_DIR)
+from fixtures import load_fixtures, make_report
+from fakes import FakeSpreadsheet, FakeESOlogsClient
+from esologs import esologs_parser, batch_fetcher
+from esologs.esologs_parser import Log, Fight
+from esologs.esologs_cache import ReportCache
+from esologs.url_scraper import get_url_from_code
+from database import database
+from database.database import RankDataBase, LogDataBase, Checkpoint
+
+
+### GLOBALS
+NUM_LOGS = 200              # logs of the rank and pipeline benchmarks
+SHEET_LATENCY = 0.          # s - per google sheet call
+PARSE_REPEAT = 20           # parses of each fixture
+TMP_DIR = tempfile.mkdtemp(prefix='esologs-counter-bench-') # journals, reports cache and urls file
+
+
+### METHODS
+def get_code(i):
+    return f'bench{i:011d}'
+
+def get_url(i):
+    return get_url_from_code(get_code(i))
+
+def make_history(num_logs):
+    # parsed synthetic logs (1 to 3 hours) with a guild of 60 members
+    logs = []
+    for i in range(num_logs):
+        log = Log.from_json(get_url(i),make_report(1+i%3,seed=i))
+        log.calculate_trials_closed()
+        logs.append(log)
+    return logs
+
+def use_spreadsheet(spreadsheet:FakeSpreadsheet):
+    # route the databases to the fake worksheets, starting from clean process-wide state
+    database.open_worksheet = spreadsheet.worksheet
+    database.Checkpoint = functools.partial(Checkpoint,data_dir=TMP_DIR)
+    database._snapshots.clear()
+    LogDataBase.seen_codes = None
+
+def format_calls(num_calls,num_logs):
+    total = sum(num_calls.values())
+    details = ', '.join(f'{a} {b}' for a,b in num_calls.most_common())
+    return f'{total} calls ({total/num_logs:.2f}/log) [{details}]'
+
+def bench_parse(fixtures,repeat=PARSE_REPEAT):
+    print('\n* Parse throughput (json decode + Log + calculate_trials_closed)')
+    for name,payload in fixtures.items():
+        num_fights = len(json.loads(payload)['fights'])
+        start = time.perf_counter()
+        for i in range(repeat):
+            log = Log.from_json(get_url(i),json.loads(payload))
+            log.calculate_trials_closed()
+        elapsed = (time.perf_counter()-start)/repeat
+        print(f'  {name:<20} {num_fights:>5} fights {len(payload)/1e3:>7.0f} kB: '
+              f'{elapsed*1e3:8.2f} ms/log, {num_fights/elapsed:>9.0f} fights/s, {len(payload)/elapsed/1e6:6.1f} MB/s')
+
+def bench_rank(logs,latency=SHEET_LATENCY):
+    print(f'\n* Rank update ({len(logs)} logs, {latency*1e3:.0f} ms per sheet call)')
+    # one session for all the logs (process_logs)
+    spreadsheet = FakeSpreadsheet(latency=latency)
+    use_spreadsheet(spreadsheet)
+    start = time.perf_counter()
+    session = RankDataBase().start_session()
+    for log in logs:
+        for trial_closed in log.trials_closed.list:
+            session.update(trial_closed.usernames_list_of_str,trial_closed.name,log.datetime_str)
+        session.update_attendees(log.attendees.list_of_str,log.trials_closed.num)
+    session.flush()
+    elapsed = time.perf_counter()-start
+    print(f'  session  : {elapsed*1e3/len(logs):8.3f} ms/log, {format_calls(spreadsheet.num_calls,len(logs))}')
+    reference = spreadsheet.worksheet('rank').get_all_values()
+    # one write per update (RankDataBase.update/update_attendees)
+    spreadsheet = FakeSpreadsheet(latency=latency)
+    use_spreadsheet(spreadsheet)
+    start = time.perf_counter()
+    for log in logs:
+        rank_db = RankDataBase()
+        for trial_closed in log.trials_closed.list:
+            rank_db.update(trial_closed.usernames_list_of_str,trial_closed.name,log.datetime_str)
+        rank_db.update_attendees(log.attendees.list_of_str,log.trials_closed.num)
+    elapsed = time.perf_counter()-start
+    print(f'  per log  : {elapsed*1e3/len(logs):8.3f} ms/log, {format_calls(spreadsheet.num_calls,len(logs))}')
+    # full rebuild (rebuild_rank)
+    spreadsheet = FakeSpreadsheet(latency=latency)
+    use_spreadsheet(spreadsheet)
+    history = [(log.datetime_str,log.attendees.list_of_str,
+                [(a.name,a.usernames_list_of_str) for a in log.trials_closed.list]) for log in logs]
+    start = time.perf_counter()
+    RankDataBase().rebuild(history,trial_columns=Fight.get_all_names())
+    elapsed = time.perf_counter()-start
+    print(f'  rebuild  : {elapsed*1e3/len(logs):8.3f} ms/log, {format_calls(spreadsheet.num_calls,len(logs))}')
+    if spreadsheet.worksheet('rank').get_all_values() != reference:
+        print('  WARNING: rebuilt rank differs from the incremental one')
+
+def bench_pipeline(num_logs,latency=SHEET_LATENCY):
+    # the procedures of main.py, with the esologs client, the reports cache and the worksheets replaced
+    import main
+    print(f'\n* load_logs_from_file + process_logs ({num_logs} logs, {latency*1e3:.0f} ms per sheet call)')
+    fixtures = {get_code(i):json.dumps(make_report(1+i%3,seed=i)).encode() for i in range(num_logs)}
+    client = FakeESOlogsClient(fixtures)
+    batch_fetcher.get_default_client = lambda: client
+    esologs_parser.REPORT_CACHE = ReportCache(cache_dir=tempfile.mkdtemp(dir=TMP_DIR))
+    spreadsheet = FakeSpreadsheet(latency=latency)
+    use_spreadsheet(spreadsheet)
+    filepath = os.path.join(TMP_DIR,'urls.txt')
+    with open(filepath,'w',encoding='utf-8') as f:
+        f.write('\n'.join(f'log of tonight {get_url(i)}' for i in range(num_logs)))
+    # load, stored logs skipped
+    start = time.perf_counter()
+    main.load_logs_from_file(filepath)
+    load_time = time.perf_counter()-start
+    print(f'  load     : {load_time*1e3/num_logs:8.3f} ms/log, esologs {client.num_requests/num_logs:.2f} requests/log, '
+          f'sheet {format_calls(spreadsheet.num_calls,num_logs)}')
+    # process (reports from the cache, as by default)
+    num_requests = client.num_requests
+    for ws in spreadsheet.worksheets.values():
+        ws.reset_calls()
+    start = time.perf_counter()
+    main.process_logs_in_db()
+    process_time = time.perf_counter()-start
+    print(f'  process  : {process_time*1e3/num_logs:8.3f} ms/log, esologs {(client.num_requests-num_requests)/num_logs:.2f} requests/log, '
+          f'sheet {format_calls(spreadsheet.num_calls,num_logs)}')
+
+### MAIN
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.ERROR)
+    args = sys.argv
+    num_logs = int(args[1]) if len(args) > 1 else NUM_LOGS
+    latency = float(args[2]) if len(args) > 2 else SHEET_LATENCY
+    bench_parse(load_fixtures())
+    bench_rank(make_history(num_logs),latency=latency)
+    bench_pipeline(num_logs,latency=latency)
@@ -0,0 +1,83 @@
+# -----------------------------------------------------------------------------
+# Copyright (C) 2024 - M. Cilento
+#
+# Title: Startup time of the procedures of main.py
+# Date of creation: oct-2026
+#
+# Description:
+#   Time, in fresh interpreters, the imports done by main.py and by each
+#   procedure before its first request (no esologs, google or discord call),
+#   and list the heavy libraries loaded. 'eager' is the import set of main.py
+#   before the lazy imports, as reference.
+#   Run "python benchmarks/startup_time.py [repeat]"
+#
+# -----------------------------------------------------------------------------
+
+
+### IMPORTING
+import os, sys, time, json, statistics, subprocess, tempfile
+
+
+### GLOBALS
+# Directories
+MODULE_DIR = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+SW_DIR=os.path.dirname(MODULE_DIR)
+
+# Procedure -> modules imported (lazily) before its first request
+FETCH = ['esologs.batch_fetcher']
+DATABASE = FETCH+['database.database']
+PROCEDURES = {'no arguments': [],
+              'analyze_logs_from_file': FETCH,
+              'load_logs_from_file': DATABASE,
+              'process_logs': DATABASE,
+              'rebuild_rank': DATABASE+['numpy'],
+              'backfill': DATABASE,
+              'discord': DATABASE+['nextcord','nextcord.ext.commands','table2ascii','pandas','aiohttp'],
+              'eager': DATABASE+['nextcord','nextcord.ext.commands','table2ascii','pandas','numpy','aiohttp','bs4']}
+HEAVY_MODULES = ['requests','gspread','backoff','numpy','pandas','table2ascii','aiohttp','nextcord','bs4']
+REPEAT = 5
+
+# Run in a fresh interpreter (cwd with a logs folder, as main.py needs)
+SCRIPT = """
+import sys, time, json, importlib
+start = time.perf_counter()
+if {import_main}:
+    import main
+for name in {modules}:
+    importlib.import_module(name)
+elapsed = time.perf_counter()-start
+print(json.dumps([elapsed,[a for a in {heavy} if a in sys.modules]]))
+"""
+
+
+### METHODS
+def time_imports(modules,import_main=True,repeat=REPEAT):
+    # (median s of the imports, median s of the whole interpreter run, heavy modules loaded)
+    code = SCRIPT.format(import_main=import_main,modules=modules,heavy=HEAVY_MODULES)
+    env = dict(os.environ,PYTHONPATH=SW_DIR)
+    imports, totals = [], []
+    with tempfile.TemporaryDirectory(prefix='esologs-counter-startup-') as cwd:
+        os.makedirs(os.path.join(cwd,'logs'))
+        for i in range(repeat):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable,'-c',code],cwd=cwd,env=env,
+                                    capture_output=True,text=True,check=True).stdout
+            totals.append(time.perf_counter()-start)
+            elapsed, loaded = json.loads(output.strip().splitlines()[-1])
+            imports.append(elapsed)
+    return statistics.median(imports), statistics.median(totals), loaded
+
+def bench_startup(repeat=REPEAT):
+    print(f'\n* Startup time (median of {repeat} runs)')
+    print(f"  {'procedure':<24} {'imports':>9} {'process':>9}  heavy modules loaded")
+    for procedure,modules in PROCEDURES.items():
+        imports, total, loaded = time_imports(modules,import_main=procedure != 'eager',repeat=repeat)
+        print(f"  {procedure:<24} {imports*1e3:7.0f} ms {total*1e3:7.0f} ms  {', '.join(loaded) or '-'}")
+
+
+### MAIN
+if __name__ == '__main__':
+
+    args = sys.argv
+    repeat = int(args[1]) if len(args) > 1 else REPEAT
+    bench_startup(repeat)
@@ -0,0 +1,64 @@
+# -----------------------------------------------------------------------------
+# Copyright (C) 2024 - M. Cilento
+#
+# Title: Checkpoints of the long procedures
+# Date of creation: oct-2026
+#
+# Description:
+#   Small json state file written atomically (temporary file, fsync and
+#   os.replace): after a crash, a Ctrl-C or an exhausted quota the file holds
+#   either the previous or the new state, never a half-written one.
+#   Used as journal by the logs processing (see database.py) and to track the
+#   progress of the backfill procedure.
+#
+# -----------------------------------------------------------------------------
+
+
+### IMPORTING
+import os, json, logging, threading
+
+
+### GLOBALS
+# Directories
+MODULE_DIR = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+SW_DIR=os.path.dirname(MODULE_DIR)
+DATA_DIR=os.path.join(SW_DIR,'data')
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+### CLASSES
+class Checkpoint:
+
+    def __init__(self,name,data_dir=DATA_DIR):
+        self.path = os.path.join(data_dir,f'{name}.json')
+        self.lock = threading.Lock()
+        os.makedirs(data_dir,exist_ok=True)
+
+    def load(self):
+        # saved state, None if missing (or unreadable)
+        try:
+            with open(self.path,'r',encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (ValueError,OSError):
+            logger.error(f'  Unreadable checkpoint {self.path}, ignored')
+            return None
+
+    def save(self,state:dict):
+        with self.lock:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path,'w',encoding='utf-8') as f:
+                json.dump(state,f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path,self.path) # atomic
+
+    def clear(self):
+        with self.lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
@@ -1,10 +1,21 @@
 
 ### IMPORTING
-import os, configparser, logging
+import os, sys, time, threading, configparser, logging, functools
 import gspread, backoff
-import pandas as pd
 from gspread import Cell
-from table2ascii import table2ascii as t2a, PresetStyle
+try:
+    from database.local_storage import LocalStorage, LocalWorksheet, SheetMirror
+    from database.checkpoint import Checkpoint
+except ModuleNotFoundError: # run as a script from the module folder
+    from local_storage import LocalStorage, LocalWorksheet, SheetMirror
+    from checkpoint import Checkpoint
+try:
+    from metrics import METRICS
+    from scheduler import QuotaScheduler
+except ModuleNotFoundError: # run as a script from the module folder
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+    from metrics import METRICS
+    from scheduler import QuotaScheduler
 logger = logging.getLogger(__name__)
 
 
@@ -22,13 +33,154 @@ config.read(os.path.join(SW_DIR,'config.ini'))
 # Backoff algorithm
 GOOGLE_API_REFRESH_TIME = 60                    # s
 MAX_BACKOFF_TIME = GOOGLE_API_REFRESH_TIME+1    # s - with margins
+FLUSH_CHUNK_SIZE = 5000                         # cells per batched write
 
 # Google sheet
 SPREADSHEET_NAME = 'esologs-counter-R02'
+GOOGLE_API_QUOTA = 60       # requests per GOOGLE_API_REFRESH_TIME
+GOOGLE_API_SCHEDULER = QuotaScheduler('sheets',limit=GOOGLE_API_QUOTA,window=GOOGLE_API_REFRESH_TIME) # every google call, interactive first
+
+# Storage backend: 'sqlite' (local database, google sheet as mirror) or 'sheets' (google sheet only)
+BACKEND = config.get('DATABASE','BACKEND',fallback='sqlite')
+MIRROR_ENABLED = config.getboolean('DATABASE','MIRROR',fallback=True)
+
+# Headers of the worksheets, written on a new local database without mirror (the
+# google sheet has them, with the formula columns of the rank)
+WORKSHEET_HEADERS = {'logs': ['timestamp','title','owner','code','url','processed','status','trials closed','attendees'],
+                     'rank': ['username','attendances','logs-with-0TC','time-last-log']}
+
+# Worksheet snapshots: get_in_batch is served from memory, refreshed after SNAPSHOT_MAX_AGE
+# seconds to catch manual edits on the sheet (0 = only when this software writes)
+SNAPSHOT_MAX_AGE = config.getfloat('DATABASE','SNAPSHOT_MAX_AGE',fallback=60)
+
+# Journal of the logs processing (see RankSession.commit)
+PROCESSING_JOURNAL = 'processing-journal'
 
 
 ### METHODS
-@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger)
+_gspread_client = None
+_spreadsheet = None
+_remote_worksheets = {}     # title -> gspread Worksheet
+_google_lock = threading.RLock()
+
+def get_gspread_client():
+    """
+    Authenticated gspread client, created once per process and shared by the
+    databases and the mirror. Its session refreshes the access token when it
+    expires (or on a 401 response), so the client and the handles opened
+    with it are never rebuilt.
+    """
+    global _gspread_client
+    with _google_lock:
+        if _gspread_client is None:
+            _gspread_client = gspread.service_account(filename=GOOGLE_KEY_DIR)
+        return _gspread_client
+
+def open_spreadsheet():
+    # shared spreadsheet handle, opened once per process
+    global _spreadsheet
+    with _google_lock:
+        if _spreadsheet is None:
+            GOOGLE_API_SCHEDULER.acquire(tokens=2) # authentication and open
+            with METRICS.track('sheets','open_spreadsheet'):
+                _spreadsheet = get_gspread_client().open(SPREADSHEET_NAME)
+        return _spreadsheet
+
+def open_remote_worksheet(title):
+    # shared gspread worksheet handle, opened once per process
+    with _google_lock:
+        if title not in _remote_worksheets:
+            spreadsheet = open_spreadsheet()
+            GOOGLE_API_SCHEDULER.acquire()
+            with METRICS.track('sheets','open_worksheet'):
+                _remote_worksheets[title] = spreadsheet.worksheet(title)
+        return _remote_worksheets[title]
+
+_local_storage = None
+_sheet_mirror = None
+_local_storage_lock = threading.Lock()
+
+def open_worksheet(title):
+    # worksheet of the configured backend (gspread Worksheet or LocalWorksheet)
+    global _local_storage, _sheet_mirror
+    if BACKEND == 'sheets':
+        return open_remote_worksheet(title)
+    with _local_storage_lock: # one storage and one mirror per process, also with concurrent bot workers
+        if _local_storage is None:
+            _local_storage = LocalStorage()
+            if MIRROR_ENABLED:
+                _sheet_mirror = SheetMirror(_local_storage,open_remote_worksheet,scheduler=GOOGLE_API_SCHEDULER)
+        ws = LocalWorksheet(title,_local_storage,mirror=_sheet_mirror) # imported from the google sheet if new
+        if _sheet_mirror is None and title in WORKSHEET_HEADERS and _local_storage.is_empty(title):
+            ws.update_cells([Cell(row=1,col=i+1,value=a) for i,a in enumerate(WORKSHEET_HEADERS[title])])
+            logger.warning(f'  New local "{title}" worksheet, header written')
+    return ws
+
+def flush_mirror():
+    # push pending local writes to the google sheet now
+    if _sheet_mirror is not None:
+        _sheet_mirror.flush()
+
+_snapshots = {}     # worksheet key -> {'records','timestamp','version'}
+_snapshots_lock = threading.RLock()
+
+def get_snapshot_key(ws):
+    return (getattr(ws,'spreadsheet_id',None),ws.title)
+
+def get_ws_version(ws):
+    # local worksheets count their writes (including imports from the mirror)
+    return getattr(ws,'version',None)
+
+def invalidate_snapshot(ws):
+    with _snapshots_lock:
+        _snapshots.pop(get_snapshot_key(ws),None)
+
+def update_snapshot(ws,cells:list,version=None):
+    # write-through of the cells in the snapshot of the worksheet, if any; version is the one
+    # of the worksheet before the write: a snapshot older than that (e.g. a mirror pull
+    # meanwhile) is dropped instead of being marked as current
+    with _snapshots_lock:
+        snapshot = _snapshots.get(get_snapshot_key(ws))
+        if snapshot is None:
+            return
+        if snapshot['version'] != version:
+            invalidate_snapshot(ws)
+            return
+        records = snapshot['records']
+        header = list(records[0].keys()) if records else []
+        for cell in cells:
+            if cell.row == 1 or cell.col > len(header): # header changed
+                invalidate_snapshot(ws)
+                return
+            while len(records) < cell.row-1:
+                records.append({a:'' for a in header})
+            records[cell.row-2][header[cell.col-1]] = cell.value
+        snapshot['version'] = get_ws_version(ws)
+
+def get_snapshot(ws):
+    with _snapshots_lock:
+        snapshot = _snapshots.get(get_snapshot_key(ws))
+        if snapshot is None:
+            return None
+        if SNAPSHOT_MAX_AGE and time.monotonic()-snapshot['timestamp'] > SNAPSHOT_MAX_AGE:
+            return None
+        if snapshot['version'] != get_ws_version(ws):
+            return None
+        return [dict(a) for a in snapshot['records']] # copy, callers may edit records
+
+def sheets_helper(func):
+    # count and time the helper, as a google call if ws is a gspread worksheet
+    @functools.wraps(func)
+    def wrapper(ws,*args,**kwargs):
+        api = 'local' if isinstance(ws,LocalWorksheet) else 'sheets'
+        if api == 'sheets':
+            GOOGLE_API_SCHEDULER.acquire()
+        with METRICS.track(api,func.__name__):
+            return func(ws,*args,**kwargs)
+    return wrapper
+
+@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger,on_backoff=METRICS.count_retry)
+@sheets_helper
 def find_row_by_val(ws,value,in_column=1):
     # get row number finding by value in a given column
     cell = ws.find(value,in_column=in_column)
@@ -37,7 +189,8 @@ def find_row_by_val(ws,value,in_column=1):
     else:
         return None
 
-@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger)
+@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger,on_backoff=METRICS.count_retry)
+@sheets_helper
 def find_col_by_val(ws,value,in_row=1):
     # get col number finding by value in a given row
     cell = ws.find(value,in_row=in_row)
@@ -46,7 +199,8 @@ def find_col_by_val(ws,value,in_row=1):
     else:
         return None
 
-@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger)
+@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger,on_backoff=METRICS.count_retry)
+@sheets_helper
 def get_numeric_value(ws,row,col):
     # get numeric value in a cell
     value = ws.cell(row, col)
@@ -55,47 +209,116 @@ def get_numeric_value(ws,row,col):
     else:
         return 0
 
-@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger)
+@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger,on_backoff=METRICS.count_retry)
+@sheets_helper
 def set_value(ws,row,col,value):
+    version = get_ws_version(ws)
     ws.update_cell(row, col, value)
+    update_snapshot(ws,[Cell(row=row, col=col, value=value)],version)
 
-@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger)
+@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger,on_backoff=METRICS.count_retry)
+@sheets_helper
 def append_row(ws,first_col_value):
+    if not isinstance(ws,LocalWorksheet):
+        GOOGLE_API_SCHEDULER.acquire() # two requests
+        METRICS.count_call('sheets')
     row_num = len(ws.col_values(1))
     ws.insert_row([first_col_value],index=row_num+1) # add to first column
+    invalidate_snapshot(ws)
+
+@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger,on_backoff=METRICS.count_retry)
+@sheets_helper
+def append_rows(ws,rows:list,table_range=None):
+    # append many rows in a single request, return the number of the first one
+    response = ws.append_rows(rows,table_range=table_range)
+    invalidate_snapshot(ws)
+    try:
+        updated_range = response['updates']['updatedRange']  # e.g. logs!A57:I58
+        return gspread.utils.a1_to_rowcol(updated_range.split('!')[-1].split(':')[0])[0]
+    except (TypeError,KeyError,IndexError):
+        return None
 
-@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger)
+@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger,on_backoff=METRICS.count_retry)
+@sheets_helper
 def append_col(ws,header):
+    if not isinstance(ws,LocalWorksheet):
+        GOOGLE_API_SCHEDULER.acquire() # two requests
+        METRICS.count_call('sheets')
     col_num = len(ws.row_values(1))
     ws.insert_cols([[header]],col=col_num+1)  # header set in first row
+    invalidate_snapshot(ws)
 
-@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger)
 def print_worksheet(ws):
     print(get_in_batch(ws))
 
-@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger)
 def get_in_batch(ws):
+    records = get_snapshot(ws)
+    if records is not None:
+        return records
+    return read_in_batch(ws)
+
+@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger,on_backoff=METRICS.count_retry)
+@sheets_helper
+def read_in_batch(ws):
+    # all records of the worksheet (snapshot refreshed)
+    version = get_ws_version(ws)
     try:
-        return ws.get_all_records() # va in errore se trova un alcune colonne di header vuote
+        records = ws.get_all_records() # va in errore se trova un alcune colonne di header vuote
     except gspread.exceptions.GSpreadException:
         logger.error(f'Header in "{ws.title}" worksheet has some holes or there are duplicate trial names. Check the header.')
-
-@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger)
+        return
+    with _snapshots_lock:
+        _snapshots[get_snapshot_key(ws)] = {'records':records,
+                                            'timestamp':time.monotonic(),
+                                            'version':version}
+    return [dict(a) for a in records]
+
+@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger,on_backoff=METRICS.count_retry)
+@sheets_helper
 def set_in_batch(ws,cells:list):
+    version = get_ws_version(ws)
     ws.update_cells(cells)
+    update_snapshot(ws,cells,version)
     logger.info(f'  "{ws.title}" worksheet updated on {len(cells)} cells')
 
+@backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger,on_backoff=METRICS.count_retry)
+@sheets_helper
+def set_ranges_in_batch(ws,data:list,cells:list):
+    # data as [{'range':'F5:H5','values':[[...]]}, ...] written in a single request,
+    # cells are the same values (to keep the snapshot updated)
+    version = get_ws_version(ws)
+    ws.batch_update(data)
+    update_snapshot(ws,cells,version)
+    logger.info(f'  "{ws.title}" worksheet updated on {len(data)} ranges')
+
+
+def recover_processing(journal:Checkpoint=None):
+    # complete a RankSession.commit interrupted by a crash, return the number of logs recovered
+    journal = journal or Checkpoint(PROCESSING_JOURNAL)
+    state = journal.load()
+    if not state:
+        return 0
+    logger.warning(f"Interrupted processing found, completing it ({len(state['processed_logs'])} logs)")
+    rank_db = RankDataBase()
+    cells = [Cell(row=row,col=col,value=value) for row,col,value in state['rank_cells']]
+    for i in range(0,len(cells),FLUSH_CHUNK_SIZE):
+        set_in_batch(rank_db.ws,cells[i:i+FLUSH_CHUNK_SIZE]) # same absolute values: no double counting
+    RankDataBase.invalidate_leaderboards()
+    LogDataBase().mark_processed_logs([tuple(a) for a in state['processed_logs']])
+    journal.clear()
+    return len(state['processed_logs'])
+
 
 ### CLASSES
 class RankDataBase:
 
     default_col = 1 # Num of col for google sheet. Only used for checks
     default_blank_line = 'This row has been intentionally left blank'
+    leaderboards = {}   # top_k -> (key, table, timestamp), memoized ascii tables (see get_ascii_table)
+    num_writes = 0      # writes on the rank by this process, invalidate the leaderboards
 
     def __init__(self):
-        self.gc = gspread.service_account(filename=GOOGLE_KEY_DIR)
-        self.sh = self.gc.open(SPREADSHEET_NAME) # spreadsheet
-        self.ws = self.sh.worksheet('rank') # worksheet
+        self.ws = open_worksheet('rank') # worksheet
 
     @property
     def url_to_worksheet(self):
@@ -106,15 +329,32 @@ class RankDataBase:
         values = get_in_batch(self.ws)
         if values == []:
             return 0
-        df = pd.DataFrame.from_dict(values)
-        df.set_index('username',inplace=True)
-        return sum(1 for i in df.index.tolist() if i not in ['',RankDataBase.default_blank_line])
+        return sum(1 for a in values if a['username'] not in ['',RankDataBase.default_blank_line])
     
     def start_up_procedure(self):
         set_value(self.ws,2,RankDataBase.default_col,value=RankDataBase.default_blank_line)
+        RankDataBase.invalidate_leaderboards()
         logger.warning('  Dumb value added in *rank* db (cell 2,1) to start update procedure')
 
-    def get_ascii_table(self):
+    @staticmethod
+    def invalidate_leaderboards():
+        RankDataBase.num_writes += 1
+
+    def get_ascii_table(self,top_k=10):
+        # memoized: rebuilt after rank writes (or local imports from the google sheet) of this process,
+        # and after SNAPSHOT_MAX_AGE seconds for the writes of other processes and the manual edits
+        key = (RankDataBase.num_writes,get_ws_version(self.ws)) # before building, writes meanwhile invalidate it
+        memo = RankDataBase.leaderboards.get(top_k)
+        if memo and memo[0] == key and not (SNAPSHOT_MAX_AGE and time.monotonic()-memo[2] > SNAPSHOT_MAX_AGE):
+            return memo[1]
+        timestamp = time.monotonic()
+        table = self.build_ascii_table(top_k)
+        RankDataBase.leaderboards[top_k] = (key,table,timestamp)
+        return table
+
+    def build_ascii_table(self,top_k=10):
+        import pandas as pd # heavy, only for the discord bot
+        from table2ascii import table2ascii as t2a, PresetStyle
         values = get_in_batch(self.ws)
 
         # Return if the database is empty
@@ -132,7 +372,7 @@ class RankDataBase:
         
         # Setting up updated rank
         df.sort_values(by=['attendances'],ascending=False, inplace=True)            # sort by attendances
-        df_subset = df[['username','attendances','n','v','v HM+1+2+3']][0:10]       # up to 10th on the ranking
+        df_subset = df[['username','attendances','n','v','v HM+1+2+3']][0:top_k]    # up to top_k-th on the ranking
         df_subset['Pos.'] = df_subset.reset_index().index + 1                       # Add rank position
         df_subset = df_subset[['Pos.','username','attendances','n','v','v HM+1+2+3']]# Change column order
         
@@ -146,110 +386,275 @@ class RankDataBase:
         )
         return output
 
+    def get_aggregator(self):
+        # in-memory rank read from the worksheet now (writes of other processes and manual edits included)
+        return RankAggregator(self)
+
     def update(self,usernames:list,
                     trial_name:str,
                     time_str:str):
         logger.info(f'*rank* db - update procedure started ({trial_name} of {time_str})')
-        cells = [] # to update
-        values = get_in_batch(self.ws)
+        aggregator = self.get_aggregator()
+        aggregator.update(usernames,trial_name,time_str)
+        aggregator.flush(self.ws)
+        logger.info(f"{trial_name} succesfully added to the *rank* database")
 
-        # Start-up if the database is empty
+    def update_attendees(self,usernames:list,
+                              number_of_trials_closed:int):
+        # To be executed after the .update method so that users are already defined
+        aggregator = self.get_aggregator()
+        aggregator.update_attendees(usernames,number_of_trials_closed)
+        aggregator.flush(self.ws)
+        logger.info(f'  Attendances number updated in *rank* db')
+
+    def start_session(self):
+        # batch many updates in a single write: call flush() on the returned aggregator
+        return RankSession(self)
+
+    @staticmethod
+    def compute_rank(history:list):
+        """
+        Full-history rank in vectorized passes. history has one entry per log,
+        in processing order: (time_str, attendees, trials_closed) with
+        trials_closed as a list of (trial_name, winners). Same rules of the
+        incremental path: users enter the rank with their first trial closed
+        and their attendances are counted only from that log on.
+        """
+        import numpy as np
+        users = {}          # username -> u (order of first trial closed)
+        trials = {}         # trial_name -> t
+        first_log = []      # u -> log of the first trial closed
+        win_u, win_t, win_l = [], [], []
+        for l,(time_str,attendees,trials_closed) in enumerate(history):
+            for trial_name,winners in trials_closed:
+                t = trials.setdefault(trial_name,len(trials))
+                for username in dict.fromkeys(winners):
+                    if username not in users:
+                        users[username] = len(users)
+                        first_log.append(l)
+                    win_u.append(users[username])
+                    win_t.append(t)
+                    win_l.append(l)
+        att_u, att_l = [], []
+        for l,(time_str,attendees,trials_closed) in enumerate(history):
+            for username in dict.fromkeys(attendees):
+                if username in users:
+                    att_u.append(users[username])
+                    att_l.append(l)
+
+        # Participation matrix (users x trials) and per-user counters
+        num_users, num_trials = len(users), len(trials)
+        win_u, win_t, win_l = np.array(win_u,dtype=np.int64), np.array(win_t,dtype=np.int64), np.array(win_l,dtype=np.int64)
+        att_u, att_l = np.array(att_u,dtype=np.int64), np.array(att_l,dtype=np.int64)
+        first_log = np.array(first_log,dtype=np.int64)
+        num_trials_closed = np.array([len(a[2]) for a in history],dtype=np.int64)
+        wins = np.zeros((num_users,num_trials),dtype=np.int64)
+        np.add.at(wins,(win_u,win_t),1)
+        is_counted = att_l >= first_log[att_u]
+        attendances = np.bincount(att_u[is_counted],minlength=num_users)
+        logs_0_TC = np.bincount(att_u[is_counted & (num_trials_closed[att_l] == 0)],minlength=num_users)
+        dates, date_index = np.unique(np.array([a[0] for a in history]+[''],dtype=str),return_inverse=True)
+        last_date = np.zeros(num_users,dtype=np.int64) # index of '' (smallest string)
+        np.maximum.at(last_date,win_u,date_index[:-1][win_l])
+        return {'users':list(users),
+                'trials':list(trials),
+                'wins':wins,
+                'attendances':attendances,
+                'logs-with-0TC':logs_0_TC,
+                'time-last-log':dates[last_date]}
+
+    def rebuild(self,history:list,trial_columns=()):
+        """
+        Rewrite the rank from scratch (see compute_rank) in a single batch.
+        Rows of the users already in the rank and the other columns (e.g.
+        formulas) are kept; trial_columns are all the possible trial names,
+        so that trial columns not in the history are cleared.
+        """
+        import numpy as np
+        logger.info(f'*rank* db - rebuild procedure started ({len(history)} logs)')
+        rank = RankDataBase.compute_rank(history)
+        aggregator = RankAggregator(self)
+        for trial_name in rank['trials']:
+            if trial_name not in aggregator.col_index:
+                aggregator.add_column(trial_name)
+        for username in rank['users']:
+            if username not in aggregator.user_rows:
+                aggregator.add_user(username)
+
+        # Target values of the software columns ('' for zeros, as the incremental path)
+        def to_cell(value):
+            value = value.item() if isinstance(value,np.generic) else value
+            return value if value not in (0,'') else ''
+        targets = {}
+        for name in ['attendances','logs-with-0TC','time-last-log']:
+            targets[name] = rank[name]
+        for t,trial_name in enumerate(rank['trials']):
+            targets[trial_name] = rank['wins'][:,t]
+        empty_column = np.zeros(len(rank['users']),dtype=np.int64)
+        for name in aggregator.header:
+            if name in trial_columns and name not in targets:
+                targets[name] = empty_column
+        rows = [aggregator.user_rows[a] for a in rank['users']]
+        users_in_history = set(rows)
+        for name,values in targets.items():
+            column = aggregator.columns[name]
+            for i,value in zip(rows,values.tolist()):
+                if column[i] != to_cell(value):
+                    aggregator.set(i,name,to_cell(value))
+            for username,i in aggregator.user_rows.items(): # users not in the history anymore
+                if i not in users_in_history and username not in ('',RankDataBase.default_blank_line) and column[i] != '':
+                    aggregator.set(i,name,'')
+
+        # Update worksheet
+        num_cells = len(aggregator.get_cells())
+        aggregator.flush(self.ws)
+        logger.info(f'*rank* db rebuilt: {len(rank["users"])} users, {len(rank["trials"])} trials ({num_cells} cells written)')
+
+class RankAggregator:
+    """
+    In-memory copy of the *rank* worksheet for incremental updates: username
+    -> row index and one dense list of values per column (trials, attendances,
+    time-last-log, ...), so every increment is O(1). Changed cells are kept
+    as deltas and written in batch by flush(). Results are the same of the
+    previous DataFrame-based update/update_attendees.
+    Always built from a fresh read (not from the snapshot): one read per
+    session, never a stale base under the increments.
+    """
+
+    def __init__(self,rank_db:RankDataBase):
+        ws = rank_db.ws
+        values = read_in_batch(ws)
         if values == []:
-            self.start_up_procedure()
-            values = get_in_batch(self.ws)
-            
-        # Open pandas dataframe to locate elements
-        df = pd.DataFrame.from_dict(values)
-        col_username = df.columns.get_loc('username')+1
-        col_timelastlog = df.columns.get_loc('time-last-log')+1
-        df.set_index('username',inplace=True)
-        num_edited_rows = df.index.size
-        last_edited_row = num_edited_rows + 1
-        last_edited_col = df.columns.size+1
-        flag_add_trial = False
-
-        # Detect column of the trial
-        if trial_name not in df.columns.values:
-            col = last_edited_col+1
-            cells.append(Cell(row=1, col=col, value=trial_name))
-            flag_add_trial=True
-            df[trial_name]=''
-        else:
-            col = df.columns.get_loc(trial_name)+2 
-
-        # Search usernames
-        for username in usernames:
-            if username in df.index:
-                row = df.index.get_loc(username)+2 
-                value = df.loc[username,trial_name]
-                timelastlog_current = df.loc[username,'time-last-log']
-                if time_str >= timelastlog_current:
-                    time_str_to_set = time_str
-                else:
-                    time_str_to_set = timelastlog_current
-                if isinstance(value,int):
-                    cells.append(Cell(row=row, col=col, value=value+1)) # update trial
-                else:
-                    cells.append(Cell(row=row, col=col, value=1)) # update trial
-                # cells.append(Cell(row=row, col=col_timelastlog, value=time_str)) # update time-last-log
+            rank_db.start_up_procedure()
+            values = read_in_batch(ws)
+        self.header = list(values[0].keys())
+        self.col_index = {a:i+1 for i,a in enumerate(self.header)}         # name -> col
+        self.columns = {a:[record[a] for record in values] for a in self.header}
+        self.num_rows = len(values)                                         # row i is in sheet row i+2
+        self.user_rows = {}                                                 # username -> row i
+        for i,username in enumerate(self.columns['username']):
+            self.user_rows.setdefault(username,i)
+        self.changed = set()                                                # (row i, name) deltas
+        self.new_cols = []                                                  # header deltas
+
+    def set(self,i,name,value):
+        self.columns[name][i] = value
+        self.changed.add((i,name))
+
+    def increment(self,i,name):
+        value = self.columns[name][i]
+        self.set(i,name,value+1 if isinstance(value,int) else 1)
+
+    def add_column(self,name):
+        self.header.append(name)
+        self.col_index[name] = len(self.header)
+        self.columns[name] = ['']*self.num_rows
+        self.new_cols.append(name)
+        logger.info(f'  New column with trial {name} added')
+
+    def add_user(self,username):
+        for column in self.columns.values():
+            column.append('')
+        i = self.num_rows
+        self.num_rows += 1
+        self.user_rows[username] = i
+        self.set(i,'username',username)
+        return i
+
+    def update(self,usernames:list,
+                    trial_name:str,
+                    time_str:str):
+        if trial_name not in self.col_index:
+            self.add_column(trial_name)
+        for username in dict.fromkeys(usernames): # once per log, also with two characters of the same account
+            i = self.user_rows.get(username)
+            if i is None:
+                i = self.add_user(username)
+                self.set(i,trial_name,1)
+                self.set(i,'time-last-log',time_str)
             else:
-                row = last_edited_row+1
-                time_str_to_set = time_str
-                cells.append(Cell(row=row, col=col_username, value=username)) # update username  
-                cells.append(Cell(row=row, col=col, value=1)) # update trial
-                # cells.append(Cell(row=row, col=col_timelastlog, value=time_str)) # update time-last-log
-                last_edited_row = last_edited_row + 1 
-            cells.append(Cell(row=row, col=col_timelastlog, value=time_str_to_set)) # update time-last-log
-        # Update worksheet
-        set_in_batch(self.ws,cells)
-        if flag_add_trial:
-            logger.info(f'  New column with trial {trial_name} added')
-        logger.info(f"{trial_name} succesfully added to the *rank* database")
+                self.increment(i,trial_name)
+                self.set(i,'time-last-log',max(time_str,self.columns['time-last-log'][i]))
 
     def update_attendees(self,usernames:list,
                               number_of_trials_closed:int):
-
         # To be executed after the .update method so that users are already defined
-        cells = [] # to update
-        values = get_in_batch(self.ws)
-
-        # Open pandas dataframe to locate elements
-        df = pd.DataFrame.from_dict(values)
-        col_attendances = df.columns.get_loc('attendances')+1
-        col_logs_0_TC = df.columns.get_loc('logs-with-0TC')+1
-        df.set_index('username',inplace=True)
-
-        # Search usernames
-        for username in usernames:
-            if username in df.index:
-                row = df.index.get_loc(username)+2 
-                # Update attendances number
-                value = df.loc[username,'attendances']
-                if isinstance(value,int):
-                    cells.append(Cell(row=row, col=col_attendances, value=value+1))
-                else:
-                    cells.append(Cell(row=row, col=col_attendances, value=1))
-                # Update logs with 0 trials closed
+        for username in dict.fromkeys(usernames):
+            i = self.user_rows.get(username)
+            if i is not None:
+                self.increment(i,'attendances')
                 if number_of_trials_closed == 0:
-                    value = df.loc[username,'logs-with-0TC']
-                    if isinstance(value,int):
-                        cells.append(Cell(row=row, col=col_logs_0_TC, value=value+1))
-                    else:
-                        cells.append(Cell(row=row, col=col_logs_0_TC, value=1))
+                    self.increment(i,'logs-with-0TC')
+
+    def get_cells(self):
+        cells = [Cell(row=1, col=self.col_index[a], value=a) for a in self.new_cols]
+        cells += [Cell(row=i+2, col=self.col_index[name], value=self.columns[name][i])
+                  for i,name in sorted(self.changed,key=lambda a: (a[0],self.col_index[a[1]]))]
+        return cells
+
+    def flush(self,ws,chunk_size=FLUSH_CHUNK_SIZE):
+        # write the deltas, in few requests
+        cells = self.get_cells()
+        if not cells:
+            return
+        for i in range(0,len(cells),chunk_size):
+            set_in_batch(ws,cells[i:i+chunk_size])
+        RankDataBase.invalidate_leaderboards()
+        self.changed = set()
+        self.new_cols = []
+
+class RankSession:
+    """
+    Write-behind session on the *rank* worksheet: every update/update_attendees
+    is applied on the aggregator and all the changed cells are written in
+    batch by flush(). Results are the same of calling RankDataBase.update/
+    update_attendees log by log.
+    """
+
+    def __init__(self,rank_db:RankDataBase):
+        self.rank_db = rank_db
+        self.aggregator = rank_db.get_aggregator()
 
-        # Update worksheet
-        set_in_batch(self.ws,cells)
-        logger.info(f'  Attendances number updated in *rank* db')
+    def update(self,usernames:list,
+                    trial_name:str,
+                    time_str:str):
+        logger.info(f'*rank* session - {trial_name} of {time_str} added')
+        self.aggregator.update(usernames,trial_name,time_str)
+
+    def update_attendees(self,usernames:list,
+                              number_of_trials_closed:int):
+        self.aggregator.update_attendees(usernames,number_of_trials_closed)
+
+    def flush(self,chunk_size=FLUSH_CHUNK_SIZE):
+        num_cells = len(self.aggregator.get_cells())
+        self.aggregator.flush(self.rank_db.ws,chunk_size=chunk_size)
+        logger.info(f'*rank* session flushed ({num_cells} cells)')
+
+    def commit(self,processed_logs:list,journal:Checkpoint=None):
+        """
+        Flush the rank and mark the logs (url, status, trials_closed_str) as
+        processed. The final values of the rank cells are journaled first: if
+        the procedure dies in between, recover_processing() writes the same
+        values again (never adding them twice) and completes the marking.
+        """
+        journal = journal or Checkpoint(PROCESSING_JOURNAL)
+        journal.save({'rank_cells':[[a.row,a.col,a.value] for a in self.aggregator.get_cells()],
+                      'processed_logs':[list(a) for a in processed_logs]})
+        self.flush()
+        LogDataBase().mark_processed_logs(processed_logs)
+        journal.clear()
 
 class LogDataBase:
 
     default_col = 1 # Num of col for google sheet. Only used for checks
     default_blank_line = 'This row has been intentionally left blank'
+    seen_codes = None                   # codes of the stored logs (whole process), see iter_new_codes
+    seen_codes_lock = threading.RLock()
 
     def __init__(self):
-        self.gc = gspread.service_account(filename=GOOGLE_KEY_DIR)
-        self.sh = self.gc.open(SPREADSHEET_NAME) # spreadsheet
-        self.ws = self.sh.worksheet('logs') # worksheet
+        self.ws = open_worksheet('logs') # worksheet
+        self.url_rows = None    # index of the logs, see load_index
+        self.code_rows = None
     
     @property
     def url_to_worksheet(self):
@@ -264,10 +669,61 @@ class LogDataBase:
         else:
             return 0
         
-    @backoff.on_exception(backoff.expo,gspread.exceptions.APIError,max_time=MAX_BACKOFF_TIME,logger=logger)
+    def load_index(self):
+        # url -> row and code -> row of the stored logs, read once per instance
+        values = get_in_batch(self.ws) or []
+        self.url_rows = {}
+        self.code_rows = {}
+        for i,record in enumerate(values):
+            if record['url'] != '':
+                self.url_rows.setdefault(record['url'],i+2)
+            if record['code'] != '':
+                self.code_rows.setdefault(record['code'],i+2)
+        LogDataBase.add_seen_codes(self.code_rows)
+
+    @staticmethod
+    def add_seen_codes(codes):
+        with LogDataBase.seen_codes_lock:
+            if LogDataBase.seen_codes is None:
+                LogDataBase.seen_codes = set()
+            LogDataBase.seen_codes.update(codes)
+
+    @staticmethod
+    def iter_new_codes(codes):
+        """
+        Yield the report codes not stored yet, to be checked right after the
+        urls extraction: duplicates cost no esologs and no google calls. The
+        *logs* worksheet is read only at the first check of the process, then
+        the set is kept updated by append_logs.
+        """
+        with LogDataBase.seen_codes_lock:
+            if LogDataBase.seen_codes is None:
+                LogDataBase().load_index()
+        for code in codes:
+            if code not in LogDataBase.seen_codes:
+                yield code
+            else:
+                logger.info(f'  Log {code} already in *logs* worksheet, skipped')
+
+    def get_row(self,url):
+        if self.url_rows is None:
+            self.load_index()
+        return self.url_rows.get(url)
+
+    def has_log(self,url,code=None):
+        if self.url_rows is None:
+            self.load_index()
+        return url in self.url_rows or (bool(code) and code in self.code_rows)
+
     def append_log(self, strftime, title, owner, code, url, attendees_str):
-        row = find_row_by_val(self.ws,url,in_column=5) # in case of duplicate, skip
-        if row == None:
+        self.append_logs([(strftime, title, owner, code, url, attendees_str)])
+
+    def append_logs(self,logs:list):
+        # logs as (strftime, title, owner, code, url, attendees_str); duplicates are skipped
+        bodies = []
+        for strftime, title, owner, code, url, attendees_str in logs:
+            if self.has_log(url,code):
+                continue
             body=[  strftime,       # A - timestamp
                     title,          # B - title
                     owner,          # C - owner
@@ -277,8 +733,17 @@ class LogDataBase:
                     '',             # G - status
                     '',             # H - trials closed
                     attendees_str]  # I - attendees
-            self.ws.append_row(body, table_range="A1:I1")
-            logger.info(f'  {title} of {strftime} correctly loaded in *logs* worksheet ({url})')
+            bodies.append(body)
+            self.url_rows[url] = None # row known after the append
+            self.code_rows[code] = None
+        if not bodies:
+            return
+        first_row = append_rows(self.ws,bodies,table_range="A1:I1")
+        LogDataBase.add_seen_codes(body[3] for body in bodies)
+        for i,body in enumerate(bodies):
+            self.url_rows[body[4]] = first_row+i if first_row else None
+            self.code_rows[body[3]] = first_row+i if first_row else None
+            logger.info(f'  {body[1]} of {body[0]} correctly loaded in *logs* worksheet ({body[4]})')
 
     def start_up_procedure(self):
         set_value(self.ws,2,LogDataBase.default_col,value=LogDataBase.default_blank_line)
@@ -289,15 +754,32 @@ class LogDataBase:
         if values == []:
             self.start_up_procedure()
             return []
-        df = pd.DataFrame.from_dict(values)
-        return df['url'].where(df['processed'] == 'N').dropna().to_list()
+        return [a['url'] for a in values if a['processed'] == 'N']
+
+    def get_processed_logs(self):
+        # (url, status) of the logs already added to the rank, in worksheet order
+        values = get_in_batch(self.ws) or []
+        return [(a['url'],a['status']) for a in values if a['processed'] == 'Y' and a['url'] != '']
     
     def mark_processed_log(self,url,status,trials_closed_str):
-        row = find_row_by_val(self.ws,url,in_column=5)
-        set_value(self.ws,row,col=6,value='Y')                  # set processed
-        set_value(self.ws,row,col=7,value=status)               # set status
-        set_value(self.ws,row,col=8,value=trials_closed_str)    # update name of trial closed
-        logger.info(f'Processed and status of the log updated for {trials_closed_str}')
+        self.mark_processed_logs([(url,status,trials_closed_str)])
+
+    def mark_processed_logs(self,logs:list):
+        # logs as (url, status, trials_closed_str); columns F:H of every log written in one request
+        data = []
+        cells = []
+        for url, status, trials_closed_str in logs:
+            row = self.get_row(url) or find_row_by_val(self.ws,url,in_column=5)
+            values = ['Y',              # F - processed
+                      status,           # G - status
+                      trials_closed_str]# H - trials closed
+            data.append({'range':f'F{row}:H{row}','values':[values]})
+            cells += [Cell(row=row, col=6+i, value=v) for i,v in enumerate(values)]
+        if not data:
+            return
+        set_ranges_in_batch(self.ws,data,cells)
+        for url, status, trials_closed_str in logs:
+            logger.info(f'Processed and status of the log updated for {trials_closed_str}')
 
 
 ### MAIN
@@ -0,0 +1,332 @@
+# -----------------------------------------------------------------------------
+# Copyright (C) 2024 - M. Cilento
+#
+# Title: Local storage backend for the databases
+# Date of creation: oct-2026
+#
+# Description:
+#   Embedded SQLite storage, authoritative for the *logs* and *rank* tables.
+#   LocalWorksheet exposes the subset of the gspread Worksheet interface used
+#   by database.py, so RankDataBase and LogDataBase work unchanged on it, but
+#   every read and write is local.
+#   The google sheet becomes an export target: SheetMirror pushes in batch
+#   (background thread) the cells written locally, then reads back the sheet
+#   so that formula columns and manual edits are available locally as well.
+#
+# -----------------------------------------------------------------------------
+
+
+### IMPORTING
+import os, sys, time, sqlite3, threading, logging, atexit
+import gspread
+from gspread import Cell
+try:
+    from metrics import METRICS
+except ModuleNotFoundError: # run as a script from the module folder
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+    from metrics import METRICS
+
+
+### GLOBALS
+# Directories
+MODULE_DIR = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+SW_DIR=os.path.dirname(MODULE_DIR)
+DATA_DIR=os.path.join(SW_DIR,'data')
+LOCAL_DB_PATH=os.path.join(DATA_DIR,'esologs-counter.sqlite')
+
+# Mirror
+MIRROR_FLUSH_INTERVAL = 30      # s - pending cells are pushed to the google sheet in batch
+MIRROR_CHUNK_SIZE = 5000        # cells per update request
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+### CLASSES
+class LocalStorage:
+
+    def __init__(self,path=LOCAL_DB_PATH):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path),exist_ok=True)
+        self.path = path
+        self.lock = threading.RLock()
+        self.versions = {}  # worksheet -> number of writes, to invalidate snapshots
+        self.conn = sqlite3.connect(path,check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            # cells of the worksheets (empty cells are not stored)
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS cells (
+                                    worksheet TEXT, row INTEGER, col INTEGER, value,
+                                    PRIMARY KEY (worksheet,row,col))""")
+            # cells written locally and not pushed to the google sheet yet ('' = cleared)
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS outbox (
+                                    worksheet TEXT, row INTEGER, col INTEGER, value,
+                                    PRIMARY KEY (worksheet,row,col))""")
+
+    def get_cells(self,title):
+        with self.lock:
+            return self.conn.execute('SELECT row, col, value FROM cells WHERE worksheet=?',(title,)).fetchall()
+
+    def is_empty(self,title):
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM cells WHERE worksheet=? LIMIT 1',(title,)).fetchone() is None
+
+    def set_cells(self,title,cells:list,dirty=True):
+        # cells as (row, col, value); '' or None clear the cell
+        with self.lock, self.conn:
+            self.write_cells(title,cells,dirty)
+            self.versions[title] = self.versions.get(title,0)+1
+
+    def write_cells(self,title,cells,dirty):
+        # to be called within a transaction
+        to_delete = [(title,r,c) for r,c,v in cells if v in ('',None)]
+        to_insert = [(title,r,c,v) for r,c,v in cells if v not in ('',None)]
+        self.conn.executemany('DELETE FROM cells WHERE worksheet=? AND row=? AND col=?',to_delete)
+        self.conn.executemany('INSERT OR REPLACE INTO cells VALUES (?,?,?,?)',to_insert)
+        if dirty:
+            self.conn.executemany('INSERT OR REPLACE INTO outbox VALUES (?,?,?,?)',
+                                  [(title,r,c,'' if v is None else v) for r,c,v in cells])
+
+    def append_cells(self,title,rows:list):
+        # write the rows after the last one, in the same transaction of the lookup; return the first row
+        with self.lock, self.conn:
+            last_row = self.conn.execute('SELECT MAX(row) FROM cells WHERE worksheet=?',(title,)).fetchone()[0]
+            first_row = (last_row or 0)+1
+            self.write_cells(title,[(first_row+i,j+1,v) for i,row in enumerate(rows)
+                                                       for j,v in enumerate(row)],dirty=True)
+            self.versions[title] = self.versions.get(title,0)+1
+        return first_row
+
+    def shift(self,title,row=None,col=None,num=1):
+        # insert num empty rows (or cols) at the given index, moving the others
+        with self.lock, self.conn:
+            if row is not None:
+                moved = self.conn.execute('SELECT row, col, value FROM cells WHERE worksheet=? AND row>=?',(title,row)).fetchall()
+                self.conn.execute('DELETE FROM cells WHERE worksheet=? AND row>=?',(title,row))
+                new_cells = [(r+num,c,v) for r,c,v in moved]
+            else:
+                moved = self.conn.execute('SELECT row, col, value FROM cells WHERE worksheet=? AND col>=?',(title,col)).fetchall()
+                self.conn.execute('DELETE FROM cells WHERE worksheet=? AND col>=?',(title,col))
+                new_cells = [(r,c+num,v) for r,c,v in moved]
+            # vacated positions are cleared on the mirror, moved cells written again
+            new_positions = set((r,c) for r,c,v in new_cells)
+            cleared = [(r,c,'') for r,c,v in moved if (r,c) not in new_positions]
+            self.write_cells(title,cleared+new_cells,dirty=True)
+            self.versions[title] = self.versions.get(title,0)+1
+
+    def get_outbox(self,title):
+        with self.lock:
+            return self.conn.execute('SELECT row, col, value FROM outbox WHERE worksheet=?',(title,)).fetchall()
+
+    def get_outbox_titles(self):
+        with self.lock:
+            return [a[0] for a in self.conn.execute('SELECT DISTINCT worksheet FROM outbox').fetchall()]
+
+    def clear_outbox(self,title,cells:list):
+        # remove pushed cells, unless they have been written again meanwhile
+        with self.lock, self.conn:
+            self.conn.executemany('DELETE FROM outbox WHERE worksheet=? AND row=? AND col=? AND value IS ?',
+                                  [(title,r,c,v) for r,c,v in cells])
+
+    def replace_worksheet(self,title,values:list):
+        # overwrite the local copy with a full grid of values (list of rows),
+        # skipped if local writes are still waiting to be pushed
+        with self.lock, self.conn:
+            if self.conn.execute('SELECT 1 FROM outbox WHERE worksheet=? LIMIT 1',(title,)).fetchone():
+                return False
+            self.conn.execute('DELETE FROM cells WHERE worksheet=?',(title,))
+            self.conn.executemany('INSERT INTO cells VALUES (?,?,?,?)',
+                                  [(title,i+1,j+1,v) for i,row in enumerate(values)
+                                                     for j,v in enumerate(row) if v not in ('',None)])
+            self.versions[title] = self.versions.get(title,0)+1
+            return True
+
+class LocalWorksheet:
+    """
+    gspread-like worksheet stored in LocalStorage. Only the methods used by
+    database.py are implemented (rows and cols are 1-based, as in gspread).
+    """
+
+    def __init__(self,title,storage:LocalStorage,mirror=None):
+        self.title = title
+        self.storage = storage
+        self.mirror = mirror
+        if mirror is not None and storage.is_empty(title):
+            mirror.pull(title) # first run: import the current google sheet
+
+    @property
+    def url(self):
+        if self.mirror is not None:
+            return self.mirror.get_remote_worksheet(self.title).url
+        return f'sqlite:///{self.storage.path}#{self.title}'
+
+    @property
+    def version(self):
+        return self.storage.versions.get(self.title,0)
+
+    def written(self):
+        if self.mirror is not None:
+            self.mirror.notify()
+
+    # Reads
+    def get_all_values(self):
+        cells = self.storage.get_cells(self.title)
+        if not cells:
+            return []
+        num_rows = max(r for r,c,v in cells)
+        num_cols = max(c for r,c,v in cells)
+        values = [['']*num_cols for _ in range(num_rows)]
+        for r,c,v in cells:
+            values[r-1][c-1] = v
+        return values
+
+    def get_all_records(self):
+        values = self.get_all_values()
+        if not values:
+            return []
+        header = values[0]
+        if len(set(header)) != len(header):
+            raise gspread.exceptions.GSpreadException('the header row in the worksheet is not unique')
+        return [dict(zip(header,row)) for row in values[1:]]
+
+    def row_values(self,row):
+        values = [(c,v) for r,c,v in self.storage.get_cells(self.title) if r == row]
+        if not values:
+            return []
+        row_values = ['']*max(c for c,v in values)
+        for c,v in values:
+            row_values[c-1] = v
+        return row_values
+
+    def col_values(self,col):
+        values = [(r,v) for r,c,v in self.storage.get_cells(self.title) if c == col]
+        if not values:
+            return []
+        col_values = ['']*max(r for r,v in values)
+        for r,v in values:
+            col_values[r-1] = v
+        return col_values
+
+    def cell(self,row,col):
+        for r,c,v in self.storage.get_cells(self.title):
+            if r == row and c == col:
+                return Cell(row,col,str(v))
+        return Cell(row,col,'')
+
+    def find(self,query,in_row=None,in_column=None):
+        matches = [(r,c,v) for r,c,v in self.storage.get_cells(self.title)
+                   if str(v) == str(query)
+                   and (in_row is None or r == in_row)
+                   and (in_column is None or c == in_column)]
+        if not matches:
+            return None
+        r,c,v = min(matches)
+        return Cell(r,c,str(v))
+
+    # Writes
+    def update_cell(self,row,col,value):
+        self.storage.set_cells(self.title,[(row,col,value)])
+        self.written()
+
+    def update_cells(self,cell_list:list):
+        self.storage.set_cells(self.title,[(a.row,a.col,a.value) for a in cell_list])
+        self.written()
+
+    def batch_update(self,data:list):
+        # data as [{'range':'F5:H5','values':[[...]]}, ...]
+        cells = []
+        for a in data:
+            row, col = gspread.utils.a1_to_rowcol(a['range'].split('!')[-1].split(':')[0])
+            cells += [(row+i,col+j,v) for i,values in enumerate(a['values'])
+                                      for j,v in enumerate(values)]
+        self.storage.set_cells(self.title,cells)
+        self.written()
+
+    def insert_row(self,values:list,index=1):
+        self.storage.shift(self.title,row=index)
+        self.storage.set_cells(self.title,[(index,j+1,v) for j,v in enumerate(values)])
+        self.written()
+
+    def insert_cols(self,values:list,col=1):
+        self.storage.shift(self.title,col=col,num=len(values))
+        self.storage.set_cells(self.title,[(i+1,col+j,v) for j,column in enumerate(values)
+                                                          for i,v in enumerate(column)])
+        self.written()
+
+    def append_row(self,values:list,table_range=None):
+        return self.append_rows([values],table_range=table_range)
+
+    def append_rows(self,values:list,table_range=None):
+        # same response of the google api (only the updated range is given)
+        first_row = self.storage.append_cells(self.title,values)
+        self.written()
+        num_cols = max((len(a) for a in values),default=1)
+        updated_range = f'{self.title}!A{first_row}:{gspread.utils.rowcol_to_a1(first_row+len(values)-1,num_cols)}'
+        return {'updates':{'updatedRange':updated_range}}
+
+class SheetMirror:
+    """
+    Export of the local storage to the google sheet. Cells written locally
+    are pushed in batch every flush_interval seconds by a background thread
+    (and at exit), then the worksheet is read back to refresh the local copy
+    with formula columns and manual edits.
+    """
+
+    def __init__(self,storage:LocalStorage,worksheet_opener,flush_interval=MIRROR_FLUSH_INTERVAL,scheduler=None):
+        self.storage = storage
+        self.worksheet_opener = worksheet_opener     # callable title -> gspread Worksheet (shared handles)
+        self.scheduler = scheduler                   # QuotaScheduler of the google calls, if any
+        self.flush_interval = flush_interval
+        self.flush_lock = threading.Lock()
+        self.event = threading.Event()
+        self.thread = threading.Thread(target=self.run,name='sheet-mirror',daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def get_remote_worksheet(self,title):
+        return self.worksheet_opener(title)
+
+    def acquire(self):
+        if self.scheduler is not None:
+            self.scheduler.acquire()
+
+    def notify(self):
+        self.event.set()
+
+    def run(self):
+        while True:
+            self.event.wait()
+            self.event.clear()
+            try:
+                self.flush()
+            except Exception as e: # never let the mirror thread die, retry next cycle
+                logger.error(f'  Google sheet mirror failed ({e}), retrying in {self.flush_interval} s')
+                self.event.set()
+            time.sleep(self.flush_interval) # writes of the next interval are batched together
+
+    def pull(self,title):
+        ws = self.get_remote_worksheet(title)
+        self.acquire()
+        with METRICS.track('sheets','mirror_pull'):
+            values = ws.get_values(value_render_option=gspread.utils.ValueRenderOption.unformatted)
+        if self.storage.replace_worksheet(title,values):
+            logger.info(f'  "{title}" worksheet imported from google sheet ({len(values)} rows)')
+
+    def push(self,title):
+        cells = self.storage.get_outbox(title)
+        if not cells:
+            return
+        ws = self.get_remote_worksheet(title)
+        for i in range(0,len(cells),MIRROR_CHUNK_SIZE):
+            chunk = cells[i:i+MIRROR_CHUNK_SIZE]
+            self.acquire()
+            with METRICS.track('sheets','mirror_push'):
+                ws.update_cells([Cell(r,c,v) for r,c,v in chunk])
+            self.storage.clear_outbox(title,chunk)
+        logger.info(f'  "{title}" worksheet mirrored on google sheet ({len(cells)} cells)')
+
+    def flush(self):
+        with self.flush_lock:
+            for title in self.storage.get_outbox_titles():
+                self.push(title)
+                self.pull(title) # formula columns and manual edits
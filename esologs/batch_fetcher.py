@@ -0,0 +1,91 @@
+# -----------------------------------------------------------------------------
+# Copyright (C) 2024 - M. Cilento
+#
+# Title: ESOlogs batch fetcher
+# Date of creation: oct-2026
+#
+# Description:
+#   Fetch many esologs reports in parallel (thread pool). The global esologs
+#   rate (3600 requests/h by default) is enforced by the quota scheduler of
+#   the client, so the wall-clock time of a batch is about num_calls/rate instead
+#   of the sum of the round trips. Results keep the order of the input urls.
+#   fetch_logs_async is the asyncio version, to be awaited by the discord bot.
+#
+# -----------------------------------------------------------------------------
+
+
+### IMPORTING
+import time, logging, asyncio, contextvars
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from esologs.esologs_parser import Log, USE_CACHE
+    from esologs.esologs_client import ESOlogsClient, AsyncESOlogsClient, get_default_client
+except ModuleNotFoundError: # run as a script from the module folder
+    from esologs_parser import Log, USE_CACHE
+    from esologs_client import ESOlogsClient, AsyncESOlogsClient, get_default_client
+
+
+### GLOBALS
+MAX_WORKERS = 8     # concurrent requests toward esologs.com
+FETCH_RETRIES = 3       # new attempts of the logs not available for a temporary reason
+FETCH_RETRY_DELAY = 10  # s - before the first new attempt, doubled at each one
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+### METHODS
+def fetch_logs(urls:list,
+               max_workers=MAX_WORKERS,
+               client:ESOlogsClient=None,
+               use_cache=USE_CACHE,
+               callback=None):
+    """
+    Return the list of Log objects of the given urls (same order of the input).
+    urls can be a generator (e.g. iter_esologs_urls_from_local_file): logs are
+    fetched while it is consumed. By default the process-wide client is used;
+    every client takes its requests from the esologs quota scheduler.
+    callback(log) is called (from the worker threads) as soon as each log is ready.
+    """
+    if isinstance(urls,(list,tuple)) and not urls:
+        return []
+    if client is None:
+        client = get_default_client()
+    logger.info(f'Fetching logs ({max_workers} workers)')
+    def fetch(url):
+        log = Log(url,use_cache=use_cache,client=client)
+        if callback:
+            callback(log)
+        return log
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # submitted as soon as each url is available, with the request priority of the caller
+        futures = [executor.submit(contextvars.copy_context().run,fetch,url) for url in urls]
+        logs = [a.result() for a in futures]
+    logger.info(f'  {sum(1 for a in logs if a.is_valid)}/{len(logs)} valid logs fetched')
+    return logs
+
+def fetch_logs_with_retries(urls:list,retries=FETCH_RETRIES,delay=FETCH_RETRY_DELAY,**kwargs):
+    """
+    fetch_logs, then the logs not available for a temporary reason (timeout,
+    connection, quota: see Log.is_retryable) are fetched again up to retries
+    times, with exponential backoff. Logs still failing are returned as they
+    are. callback, if given, is called only at the first attempt.
+    """
+    logs = fetch_logs(urls,**kwargs)
+    kwargs.pop('callback',None)
+    for attempt in range(retries):
+        failed = [i for i,log in enumerate(logs) if log.is_retryable]
+        if not failed:
+            break
+        wait = delay*2**attempt
+        logger.warning(f'  {len(failed)} logs not available now ({logs[failed[0]].status}), new attempt in {wait} s')
+        time.sleep(wait)
+        for i,log in zip(failed,fetch_logs([logs[i].url for i in failed],**kwargs)):
+            logs[i] = log
+    return logs
+
+async def fetch_logs_async(urls:list,
+                           client:AsyncESOlogsClient=None,
+                           use_cache=USE_CACHE):
+    # awaitable version of fetch_logs, the rate limit is shared with the sync clients
+    return list(await asyncio.gather(*(Log.fetch(url,use_cache=use_cache,client=client) for url in urls)))
@@ -0,0 +1,138 @@
+# -----------------------------------------------------------------------------
+# Copyright (C) 2024 - M. Cilento
+#
+# Title: ESOlogs reports cache
+# Date of creation: oct-2026
+#
+# Description:
+#   Persistent on-disk cache for the /v1/report/fights responses, keyed by the
+#   log code. One json file per report is stored in the cache folder.
+#   Reports still being uploaded (live logs) can change, so they expire after
+#   a short TTL; closed reports are kept until evicted (least recently used).
+#
+# -----------------------------------------------------------------------------
+
+
+### IMPORTING
+import os, json, time, logging, threading
+
+
+### GLOBALS
+# Directories
+MODULE_DIR = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+SW_DIR=os.path.dirname(MODULE_DIR)
+CACHE_DIR=os.path.join(SW_DIR,'cache','reports')
+
+# Cache policy
+MAX_ENTRIES = 5000              # reports stored before eviction
+EVICTION_LOW_WATER = 0.9        # fraction of max_entries kept by an eviction, so it runs once every few hundred reports
+LIVE_REPORT_WINDOW = 6*3600     # s - a report fetched within this time from its end may still be live
+LIVE_REPORT_TTL = 15*60         # s - expiration of live reports
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+### CLASSES
+class ReportCache:
+
+    def __init__(self,cache_dir=CACHE_DIR,
+                      max_entries=MAX_ENTRIES,
+                      low_water=EVICTION_LOW_WATER,
+                      live_ttl=LIVE_REPORT_TTL,
+                      live_window=LIVE_REPORT_WINDOW):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.num_kept = int(max_entries*low_water) # entries left by an eviction
+        self.live_ttl = live_ttl
+        self.live_window = live_window
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir,exist_ok=True)
+        self.num_entries = sum(1 for a in os.scandir(self.cache_dir) if a.name.endswith('.json'))
+
+    def __len__(self) -> int:
+        return self.num_entries
+
+    @staticmethod
+    def is_valid_code(code):
+        # codes are used as filenames, avoid path traversal or odd names
+        return bool(code) and code.isalnum()
+
+    def get_path(self,code):
+        return os.path.join(self.cache_dir,f'{code}.json')
+
+    def is_expired(self,entry):
+        fetched_at = entry['fetched_at']
+        report_end = int(entry['json'].get('end',0))/1000
+        if fetched_at - report_end < self.live_window: # fetched while the report was live
+            return time.time() - fetched_at > self.live_ttl
+        else:
+            return False
+
+    def get(self,code):
+        # return the cached json of the report, None if missing or expired
+        if not ReportCache.is_valid_code(code):
+            return None
+        path = self.get_path(code)
+        try:
+            with open(path,'r',encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (ValueError,OSError):
+            logger.warning(f'  Corrupted cache entry for {code}, discarded')
+            self.delete(code)
+            return None
+        if self.is_expired(entry):
+            logger.debug(f'  Cache entry for {code} expired (live report)')
+            self.delete(code)
+            return None
+        try:
+            os.utime(path) # touch, for least recently used eviction
+        except OSError:
+            pass
+        return entry['json']
+
+    def set(self,code,payload):
+        if not ReportCache.is_valid_code(code):
+            return
+        path = self.get_path(code)
+        entry = {'fetched_at':time.time(),'json':payload}
+        with self.lock:
+            is_new = not os.path.exists(path)
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(tmp_path,'w',encoding='utf-8') as f:
+                json.dump(entry,f)
+            os.replace(tmp_path,path) # atomic, readers never see half-written files
+            if is_new:
+                self.num_entries += 1
+            if self.num_entries > self.max_entries:
+                self.evict()
+
+    def delete(self,code):
+        with self.lock:
+            try:
+                os.remove(self.get_path(code))
+                self.num_entries -= 1
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        # remove the least recently used entries down to num_kept (to be called with the lock held)
+        entries = [a for a in os.scandir(self.cache_dir) if a.name.endswith('.json')]
+        entries.sort(key=lambda a: a.stat().st_mtime)
+        num_to_remove = max(len(entries)-self.num_kept,0)
+        for entry in entries[:num_to_remove]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        self.num_entries = len(entries)-num_to_remove
+        logger.info(f'  Reports cache evicted {num_to_remove} entries')
+
+    def clear(self):
+        with self.lock:
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith('.json'):
+                    os.remove(entry.path)
+            self.num_entries = 0
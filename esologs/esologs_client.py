@@ -0,0 +1,167 @@
+# -----------------------------------------------------------------------------
+# Copyright (C) 2024 - M. Cilento
+#
+# Title: ESOlogs HTTP client
+# Date of creation: oct-2026
+#
+# Description:
+#   Shared HTTP client for all esologs.com API calls. It owns a pooled
+#   requests.Session (keep-alive connections reused among reports) and
+#   applies connect/read deadlines to every request, so that a stalled
+#   socket can never hang a batch or the discord bot.
+#   Requests are also throttled by the esologs quota scheduler shared by the
+#   whole process (esologs allows 3600 requests/h), interactive requests first.
+#   AsyncESOlogsClient is the asyncio counterpart (aiohttp), used by the bot.
+#
+# -----------------------------------------------------------------------------
+
+
+### IMPORTING
+import os, sys, logging, threading, configparser
+import requests
+from requests.adapters import HTTPAdapter
+try:
+    from metrics import METRICS
+    from scheduler import QuotaScheduler
+except ModuleNotFoundError: # run as a script from the module folder
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+    from metrics import METRICS
+    from scheduler import QuotaScheduler
+
+
+### GLOBALS
+# Directories
+MODULE_DIR = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+SW_DIR=os.path.dirname(MODULE_DIR)
+
+# Config file
+config = configparser.ConfigParser()
+config.read(os.path.join(SW_DIR,'config.ini'))
+
+# Rate limit
+RATE_LIMIT_PER_HOUR = config.getint('ESOLOGS','RATE_LIMIT_PER_HOUR',fallback=3600)
+RATE_LIMIT_BURST = config.getint('ESOLOGS','RATE_LIMIT_BURST',fallback=10)
+
+# Connection pool
+POOL_MAXSIZE = 16               # connections kept alive toward esologs.com
+CONNECT_TIMEOUT = 5             # s
+READ_TIMEOUT = 30               # s - big logs may take a while to be served
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+### CLASSES
+class ESOlogsClient:
+
+    def __init__(self,pool_maxsize=POOL_MAXSIZE,
+                      connect_timeout=CONNECT_TIMEOUT,
+                      read_timeout=READ_TIMEOUT,
+                      rate_limiter=None):
+        self.timeout = (connect_timeout,read_timeout)
+        self.rate_limiter = rate_limiter or get_default_rate_limiter()
+        self.num_requests = 0   # requests sent by this client
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,pool_maxsize=pool_maxsize,pool_block=True)
+        self.session.mount('https://',adapter)
+        self.session.mount('http://',adapter)
+
+    def get(self,url,**kwargs):
+        # raise requests.exceptions.Timeout if a deadline is exceeded
+        kwargs.setdefault('timeout',self.timeout)
+        self.rate_limiter.acquire()
+        with self.lock:
+            self.num_requests += 1
+        with METRICS.track('esologs',get_endpoint(url)) as call:
+            response = self.session.get(url,**kwargs)
+            call['outcome'] = 'ok' if response.status_code == 200 else f'http_{response.status_code}'
+        return response
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+class AsyncESOlogsClient:
+
+    def __init__(self,pool_maxsize=POOL_MAXSIZE,
+                      connect_timeout=CONNECT_TIMEOUT,
+                      read_timeout=READ_TIMEOUT,
+                      rate_limiter=None):
+        import aiohttp # only the discord bot fetches asynchronously
+        self.timeout = aiohttp.ClientTimeout(total=connect_timeout+read_timeout,
+                                             sock_connect=connect_timeout,
+                                             sock_read=read_timeout)
+        self.pool_maxsize = pool_maxsize
+        self.rate_limiter = rate_limiter or get_default_rate_limiter()
+        self.num_requests = 0   # requests sent by this client
+        self.session = None # aiohttp sessions must be created inside the running loop
+
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            import aiohttp
+            connector = aiohttp.TCPConnector(limit=self.pool_maxsize)
+            self.session = aiohttp.ClientSession(connector=connector,timeout=self.timeout)
+        return self.session
+
+    async def get_json(self,url):
+        # return (status code, json or None); raise asyncio.TimeoutError or aiohttp.ClientError
+        await self.rate_limiter.acquire_async()
+        self.num_requests += 1
+        with METRICS.track('esologs',get_endpoint(url)) as call:
+            async with self.get_session().get(url) as response:
+                if response.status == 200:
+                    return response.status, await response.json(content_type=None)
+                else:
+                    call['outcome'] = f'http_{response.status}'
+                    return response.status, None
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self,*args):
+        await self.close()
+
+
+### METHODS
+def get_endpoint(url):
+    # e.g. https://www.esologs.com/v1/report/fights/{code}?api_key=... -> report
+    return url.split('/v1/')[-1].split('?')[0].split('/')[0]
+
+_default_client = None
+_default_async_client = None
+_default_client_lock = threading.RLock()
+_default_rate_limiter = None
+
+def get_default_rate_limiter():
+    # process-wide esologs quota scheduler, shared by all clients
+    global _default_rate_limiter
+    with _default_client_lock:
+        if _default_rate_limiter is None:
+            _default_rate_limiter = QuotaScheduler('esologs',limit=RATE_LIMIT_PER_HOUR,window=3600,capacity=RATE_LIMIT_BURST)
+        return _default_rate_limiter
+
+def get_default_client():
+    # process-wide client, lazily created
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = ESOlogsClient()
+        return _default_client
+
+def get_default_async_client():
+    # process-wide asyncio client (its session is bound to the running loop)
+    global _default_async_client
+    with _default_client_lock:
+        if _default_async_client is None:
+            _default_async_client = AsyncESOlogsClient()
+        return _default_async_client
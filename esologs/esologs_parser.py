@@ -19,8 +19,13 @@
 
 
 ### IMPORTING
-import os, requests, json, datetime, configparser, logging, sys
-from bs4 import BeautifulSoup
+import os, requests, json, datetime, configparser, logging, sys, asyncio, functools
+try:
+    from esologs.esologs_cache import ReportCache
+    from esologs.esologs_client import ESOlogsClient, AsyncESOlogsClient, get_default_client, get_default_async_client
+except ModuleNotFoundError: # run as a script from the module folder
+    from esologs_cache import ReportCache
+    from esologs_client import ESOlogsClient, AsyncESOlogsClient, get_default_client, get_default_async_client
 
 
 ### GLOBALS
@@ -28,21 +33,46 @@ from bs4 import BeautifulSoup
 MODULE_DIR = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
 SW_DIR=os.path.dirname(MODULE_DIR)
 LOGS_DIR=os.path.join(SW_DIR,'logs')
+ZONES_JSON_PATH=os.path.join(MODULE_DIR,'zones.json')     # zones as downloaded from esologs
+TRIALS_JSON_PATH=os.path.join(MODULE_DIR,'trials.json')   # trials analyzed (abbreviations, aliases)
                               
 # Config file
 config = configparser.ConfigParser()
 config.read(os.path.join(SW_DIR,'config.ini'))
 
 # ESOlogs
-API_KEY = config['ESOLOGS']['API_KEY']
+API_KEY = config.get('ESOLOGS','API_KEY',fallback='') # not needed offline (reports cache, benchmarks)
 VERBOSE = True
 
+# Difficulties: id -> (name, prefix, suffix) of the trial name (e.g. vSS HM)
+DIFFICULTIES = {120: ('Normal',    'n', ''),
+                121: ('Veteran',   'v', ''),
+                122: ('Hard Mode', 'v', ' HM'),
+                123: ('Veteran+1', 'v', '+1'),
+                124: ('Veteran+2', 'v', '+2'),
+                125: ('Veteran+3', 'v', '+3')}
+
+# Classes of human friendlies (see classes request via API V1)
+HUMAN_CLASSES = frozenset(['DragonKnight','Arcanist','Templar',
+                           'Nightblade','Sorcerer','Warden',
+                           'Necromancer'])
+
+# Reports cache (set USE_CACHE = no in config.ini to always call the API)
+USE_CACHE = config.getboolean('ESOLOGS','USE_CACHE',fallback=True)
+REPORT_CACHE = ReportCache(max_entries=config.getint('ESOLOGS','CACHE_MAX_ENTRIES',fallback=5000))
+
+# Errors worth a retry later (exhausted quota, esologs down), see Log.is_retryable
+RETRYABLE_STATUS_CODES = (429,500,502,503,504)
+
 # Logging
 logger = logging.getLogger(__name__)
 
 
 ### CLASSES
 class SpecialList:
+
+    __slots__ = ('list',)
+
     def __init__(self,_list: list):
         self.list = _list
     
@@ -65,23 +95,38 @@ class SpecialList:
         return [str(a) for a in self.list]
 
 class Zone:
+    """
+    Trial zones are interned (flyweight): Zone(name) returns the single shared
+    and immutable instance registered for a full name, alias or abbreviation.
+    The registry is built once from trials.json, so new trials are added there.
+    The final boss of a trial is its last encounter in zones.json, or the one
+    given in trials.json for trials newer than the downloaded zones.json.
+    """
+
+    __slots__ = ('is_valid','name','name_short','final_boss_id','final_boss_name')
+    registry = {}   # name/alias/abbreviation -> Zone
+    invalid = None  # Zone returned for unknown names
 
     @staticmethod
-    def get_zone_json(api_call=False):
+    def get_zone_json(api_call=False,client:ESOlogsClient=None):
         if api_call:
             # API call to retrieve information on all zones
+            client = client or get_default_client()
             url = f'https://www.esologs.com/v1/zones?api_key={API_KEY}'
-            response = requests.get(url)
+            response = client.get(url)
             if response.status_code == 200:
                 return response.json()
             else:
                 return None
         else:
             # to avoid API call
-            f = open('zones.json')
-            zones = json.load(f)
-            f.close()
-            return zones
+            return Zone.load_json(ZONES_JSON_PATH)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def load_json(path):
+        with open(path,encoding='utf-8') as f:
+            return json.load(f)
 
     @staticmethod
     def scrape_zone_json():
@@ -96,67 +141,40 @@ class Zone:
                                  'final_boss_id':final_boss_id,
                                  'final_boss_name':final_boss_name})
         return scrape_result
-        
-    def __init__(self,name):
-        self.is_valid = True
-        self.name = name                # string name of the zone (complete or abbreviated)
-        if   name in ('Aetherian Archive','AA'):
-            self.name_short = 'AA'
-            self.final_boss_id   = 4
-            self.final_boss_name = 'The Mage'
-        elif name in ('Hel Ra Citadel','HRC'):
-            self.name_short = 'HRC'
-            self.final_boss_id   = 8
-            self.final_boss_name = 'The Warrior'
-        elif name in ('Sanctum Ophidia','SO'):
-            self.name_short = 'SO'
-            self.final_boss_id   = 12
-            self.final_boss_name = 'The Serpent'
-        elif name in ('Maw of Lorkhaj','MOL'):
-            self.name_short = 'MOL'
-            self.final_boss_id   = 15
-            self.final_boss_name = 'Rakkhat'
-        elif name in ('Halls of Fabrication','HOF','The Halls of Fabrication'):
-            self.name_short = 'HOF'
-            self.final_boss_id   = 20
-            self.final_boss_name = 'Assembly General'
-        elif name in ('Asylum Sanctorium','AS'):
-            self.name_short = 'AS'
-            self.final_boss_id   = 23
-            self.final_boss_name = 'Saint Olms the Just'
-        elif name in ('Cloudrest','CR'):
-            self.name_short = 'CR'
-            self.final_boss_id   = 27
-            self.final_boss_name = "Z'Maja"
-        elif name in ('Sunspire','SS'):
-            self.name_short = 'SS'
-            self.final_boss_id   = 45
-            self.final_boss_name = 'Nahviintaas'
-        elif name in ("Kyne's Aegis",'KA'):
-            self.name_short = 'KA'
-            self.final_boss_id   = 48
-            self.final_boss_name = 'Lord Falgravn'
-        elif name in ('Rockgrove','RG'):
-            self.name_short = 'RG'
-            self.final_boss_id   = 51
-            self.final_boss_name = 'Xalvakka'
-        elif name in ('Dreadsail Reef','DSR'):
-            self.name_short = 'DSR'
-            self.final_boss_id   = 54
-            self.final_boss_name = 'Tideborn Taleria'
-        elif name in ("Sanity's Edge",'SE'):
-            self.name_short = 'SE'
-            self.final_boss_id   = 57
-            self.final_boss_name = 'Ansuul the Tormentor'
-        elif name in ("Lucent Citadel",'LC'):
-            self.name_short = 'LC'
-            self.final_boss_id   = 60
-            self.final_boss_name = 'Xoryn'
-        else:
-            self.is_valid = False
-            self.name_short = None
-            self.final_boss_id   = None
-            self.name = 'n/a'
+
+    @classmethod
+    def build_registry(cls,path):
+        cls.registry = {}
+        cls.invalid = cls.create(False,'n/a',None,None,None)
+        final_bosses = {a['name']:a for a in Zone.scrape_zone_json()}
+        for trial in Zone.load_json(path):
+            names = [trial['name']]+trial['aliases'] # zones.json may use an alias
+            final_boss = trial if 'final_boss_id' in trial else next((final_bosses[a] for a in names if a in final_bosses),None)
+            if final_boss is None:
+                raise ValueError(f"Final boss of {trial['name']} not found in zones.json, add final_boss_id and final_boss_name to trials.json")
+            zone = cls.create(True,trial['name'],trial['name_short'],final_boss['final_boss_id'],final_boss['final_boss_name'])
+            for name in [trial['name'],trial['name_short']]+trial['aliases']:
+                cls.registry[name] = zone
+
+    @classmethod
+    def create(cls,is_valid,name,name_short,final_boss_id,final_boss_name):
+        zone = object.__new__(cls)
+        object.__setattr__(zone,'is_valid',is_valid)
+        object.__setattr__(zone,'name',name)                   # string name of the zone (complete)
+        object.__setattr__(zone,'name_short',name_short)
+        object.__setattr__(zone,'final_boss_id',final_boss_id)
+        object.__setattr__(zone,'final_boss_name',final_boss_name)
+        return zone
+
+    def __new__(cls,name):
+        # name of the zone (complete or abbreviated)
+        return cls.registry.get(name,cls.invalid)
+
+    def __setattr__(self,name,value):
+        raise AttributeError('Zone objects are immutable')
+
+    def __reduce__(self):
+        return (Zone,(self.name,))
 
     def __str__(self) -> str:
         return self.name
@@ -166,9 +184,14 @@ class Zone:
             return True
         else:
             return False
+
+Zone.build_registry(TRIALS_JSON_PATH)
         
 class Fight:
 
+    __slots__ = ('type','id','boss_id','boss_name','zone','kill',
+                 'difficulty_id','difficulty','difficulty_prefix','difficulty_suffix')
+
     def __init__(self,fight_dict):
         if fight_dict.get('difficulty'): # is a boss
             self.type = 'boss'
@@ -196,32 +219,15 @@ class Fight:
             return False
 
     def assign_difficulty(self):
-        if self.difficulty_id == 120:
-            self.difficulty = 'Normal'
-            self.difficulty_prefix = 'n'
-            self.difficulty_suffix = ''
-        elif self.difficulty_id == 121:
-            self.difficulty = 'Veteran'
-            self.difficulty_prefix = 'v'
-            self.difficulty_suffix = ''
-        elif self.difficulty_id == 122:
-            self.difficulty = 'Hard Mode'
-            self.difficulty_prefix = 'v'
-            self.difficulty_suffix = ' HM'
-        elif self.difficulty_id == 123:
-            self.difficulty = 'Veteran+1'
-            self.difficulty_prefix = 'v'
-            self.difficulty_suffix= '+1'
-        elif self.difficulty_id == 124:
-            self.difficulty = 'Veteran+2'
-            self.difficulty_prefix = 'v'
-            self.difficulty_suffix = '+2'
-        elif self.difficulty_id == 125:
-            self.difficulty = 'Veteran+3'
-            self.difficulty_prefix = 'v'
-            self.difficulty_suffix = '+3'
-        else:
-            pass
+        if self.difficulty_id in DIFFICULTIES:
+            self.difficulty, self.difficulty_prefix, self.difficulty_suffix = DIFFICULTIES[self.difficulty_id]
+
+    @staticmethod
+    def get_all_names():
+        # every possible trial name (e.g. vSS HM), for all the zones and difficulties
+        zones = set(a for a in Zone.registry.values())
+        return set(f"{prefix}{zone.name_short}{suffix}" for zone in zones
+                                                        for difficulty,prefix,suffix in DIFFICULTIES.values())
 
     @property
     def name(self):
@@ -239,17 +245,16 @@ class Fight:
 
 class Friendly:
 
+    __slots__ = ('is_human','class_','anonymous','username','fights')
+
     def __init__(self,friend_dict):
         _type = friend_dict['type']
-        if _type in ['DragonKnight','Arcanist','Templar',
-                     'Nightblade','Sorcerer','Warden',
-                     'Necromancer']: # see classes request via API V1
+        if _type in HUMAN_CLASSES:
             self.is_human = True
-            self.dict = friend_dict
             self.class_ = _type
             self.anonymous = friend_dict['anonymous']
             self.username = friend_dict['displayName']
-            self.fights = self.get_fights_id()
+            self.fights = Friendly.get_fights_id(friend_dict) # raw dict not retained
         else:
             self.is_human = False
 
@@ -259,11 +264,9 @@ class Friendly:
         else:
             return 'not-human'
     
-    def get_fights_id(self):
-        list_fights_id = []
-        for fight in self.dict['fights']:
-            list_fights_id.append(fight['id'])
-        return list_fights_id
+    @staticmethod
+    def get_fights_id(friend_dict):
+        return tuple(fight['id'] for fight in friend_dict['fights'])
     
     def partecipated_to(self,fight_id):
         if self.is_human and fight_id in self.fights:
@@ -273,6 +276,8 @@ class Friendly:
 
 class TrialClosed:
 
+    __slots__ = ('fight','winners')
+
     def __init__(self,fight:Fight,winners:SpecialList):
         self.fight = fight
         self.winners = winners
@@ -301,47 +306,161 @@ class APIError(Exception):
     pass
 
 class Log:
+
+    # attributes available only once the report is loaded (see lazy loading)
+    lazy_attributes = ('is_valid','json','response','owner','datetime','datetime_str','title')
     
-    def __init__(self,url):
+    def __init__(self,url,use_cache=USE_CACHE,client:ESOlogsClient=None,lazy=False):
         """
         Log Status (visible from logs db):
            - NOT ASSIGNET YET    : when created, not visible outside the class herebelow
            - VALID LOG           : log with valid information
            - API ERROR           : error with esologs api call, retry
            - CONNECTION ERORR    : in case of connection lost during the api-call
+           - TIMEOUT ERROR       : esologs did not answer within the client deadlines, retry
            - X TC                : indicating the number of trial closed
            - NO TC               : no trial closed in the log
+        With use_cache=False the reports cache is bypassed (the response is still stored).
+        Requests go through the shared ESOlogsClient (pooled connections and timeouts),
+        unless a client is given.
+        With lazy=True nothing is downloaded until load() is called or a report
+        attribute (title, owner, json, ...) is accessed.
         """
-        self.url = url    # complete url of the log 
-        self.code = self.url.split('/')[-1] # code = final chunk of link
-        self.request_url=f"https://www.esologs.com/v1/report/fights/{self.code}?api_key={API_KEY}"
-        self.status = 'NOT ASSIGNET YET'
+        self.set_url(url)
+        self.use_cache = use_cache
+        self.client = client
+        if not lazy:
+            self.load()
+
+    @classmethod
+    def from_json(cls,url,payload):
+        """
+        Build the log from an already downloaded /report/fights json (cached
+        file, fixture, batched loader): no network call is done.
+        """
+        log = cls.__new__(cls)
+        log.set_url(url)
+        log.use_cache, log.client = USE_CACHE, None
+        log.response = None
+        log.set_json(payload)
+        return log
+
+    def __getattr__(self,name):
+        # called only for missing attributes: trigger the lazy download
+        if name in Log.lazy_attributes and not self.__dict__.get('is_loaded',True):
+            self.load()
+            return object.__getattribute__(self,name)
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def load(self):
+        # download the report (or get it from cache), only once
+        if self.is_loaded:
+            return
         logger.info(f'Analyzing url {self.url}') 
+        cached_json = REPORT_CACHE.get(self.code) if self.use_cache else None
+        if cached_json is not None:
+            self.response = None
+            logger.debug('  Report loaded from cache')
+            self.set_json(cached_json)
+            return
         try:
-            self.response = requests.get(self.request_url)
+            client = self.client or get_default_client()
+            self.response = client.get(self.request_url)
+            self.status_code = self.response.status_code
             if self.response.status_code == 200:
-                self.is_valid = True
-                self.status = 'VALID LOG'
-                self.json = self.response.json()
+                payload = self.response.json()
+                REPORT_CACHE.set(self.code,payload)
                 logger.debug('  Request done with success')
             else:
                 raise APIError('Request done, but the log is not valid')
         except APIError:
-            logger.critical('  Request done, but the log is not valid (API erorr, status code != 200)')
-            self.set_invalid_prop()
-            self.status = 'API ERROR'
+            self.set_error('API ERROR')
+            return
+        except requests.exceptions.Timeout:
+            self.set_error('TIMEOUT ERROR')
             return
         except requests.exceptions.ConnectionError:
-            logger.critical('  Connection erorr, please retry')
-            self.set_invalid_prop()
-            self.status = 'CONNECTION ERORR'
+            self.set_error('CONNECTION ERORR')
             return
+        self.set_json(payload)
+
+    @classmethod
+    async def fetch(cls,url,use_cache=USE_CACHE,client:AsyncESOlogsClient=None):
+        """
+        Awaitable counterpart of Log(url): the report is downloaded without
+        blocking the event loop (e.g. in discord bot handlers). Statuses and
+        parsing are the same of the synchronous constructor.
+        """
+        from aiohttp import ClientError # only the discord bot fetches asynchronously
+        log = cls.__new__(cls)
+        log.set_url(url)
+        log.use_cache, log.client = use_cache, client
+        logger.info(f'Analyzing url {log.url}')
+        log.response = None
+        cached_json = await asyncio.to_thread(REPORT_CACHE.get,log.code) if use_cache else None # file and json off the event loop
+        if cached_json is not None:
+            logger.debug('  Report loaded from cache')
+            log.set_json(cached_json)
+            return log
+        try:
+            client = client or get_default_async_client()
+            status_code, payload = await client.get_json(log.request_url)
+            log.status_code = status_code
+            if status_code == 200:
+                await asyncio.to_thread(REPORT_CACHE.set,log.code,payload)
+                logger.debug('  Request done with success')
+            else:
+                raise APIError('Request done, but the log is not valid')
+        except APIError:
+            log.set_error('API ERROR')
+            return log
+        except asyncio.TimeoutError:
+            log.set_error('TIMEOUT ERROR')
+            return log
+        except ClientError:
+            log.set_error('CONNECTION ERORR')
+            return log
+        log.set_json(payload)
+        return log
+
+    def set_url(self,url):
+        self.url = url    # complete url of the log 
+        self.code = self.url.split('/')[-1] # code = final chunk of link
+        self.request_url=f"https://www.esologs.com/v1/report/fights/{self.code}?api_key={API_KEY}"
+        self.status = 'NOT ASSIGNET YET'
+        self.status_code = None # of the esologs response, if any
+        self.is_loaded = False
+
+    def set_json(self,payload):
+        # valid report downloaded (or cached): parse the general information
+        self.is_loaded = True
+        self.is_valid = True
+        self.status = 'VALID LOG'
+        self.json = payload
         self.owner = self.get_owner()
         self.datetime = self.get_datetime()
         self.datetime_str = self.datetime.strftime('%Y/%m/%d')
         self.title = self.get_title()
         logger.info(f'  Valid log enterd: {self.title} ({self.datetime_str})')
+
+    def set_error(self,status):
+        if status == 'API ERROR':
+            logger.critical('  Request done, but the log is not valid (API erorr, status code != 200)')
+        elif status == 'TIMEOUT ERROR':
+            logger.critical('  Timeout error, esologs did not answer in time, please retry')
+        else:
+            logger.critical('  Connection erorr, please retry')
+        self.is_loaded = True
+        self.set_invalid_prop()
+        self.status = status
     
+    @property
+    def is_retryable(self):
+        # not loaded for a temporary reason (quota, timeout, connection): fetch it again later
+        if self.status in ('TIMEOUT ERROR','CONNECTION ERORR'):
+            return True
+        return self.status == 'API ERROR' and self.status_code in RETRYABLE_STATUS_CODES
+
     def set_invalid_prop(self):
         self.is_valid = False
         self.json = None
@@ -375,6 +494,14 @@ class Log:
             logger.warning(f'  No attendees found.')
         return SpecialList(attendees)
     
+    def get_participants_index(self):
+        # fight id -> attendees in that fight (in attendees order), in a single pass
+        participants = {}
+        for attendee in self.attendees.list:
+            for fight_id in dict.fromkeys(attendee.fights): # unique ids, order kept
+                participants.setdefault(fight_id,[]).append(attendee)
+        return participants
+
     def calculate_trials_closed(self):
         
         # Inizialization
@@ -385,8 +512,9 @@ class Log:
             logger.warning(f'  Log not valid, no fights found.')
             return
         
-        # Get attendees
+        # Get attendees and index them by fight
         self.attendees = self.get_attendees()
+        participants = self.get_participants_index()
 
         # Get fights
         _fights = self.json['fights']
@@ -396,11 +524,8 @@ class Log:
         trials_closed = []
         logger.info(f'- Analyzing fights:')
         for fight in fights:
-            winners = []
             if fight.is_final_boss and fight.kill: # compare boss id and if last pull
-                for attendee in self.attendees.list:
-                    if attendee.partecipated_to(fight.id):
-                        winners.append(attendee)
+                winners = participants.get(fight.id,[])
                 trial_closed = TrialClosed(fight,SpecialList(winners))
                 trials_closed.append(trial_closed)
                 logger.info(f'  Found last pull kill: {trial_closed.description}')
@@ -432,9 +557,9 @@ if __name__ == '__main__':
     for zone in zones_json:
         name = zone['name']
         zone_obj = Zone(name)            # zones under analysis
-        try:
+        if zone_obj.is_valid:
             print(f"   @{name} ({zone_obj.name_short}) the final boss is {zone_obj.final_boss_name} (id = {zone_obj.final_boss_id})")
-        except:
+        else:
             print(f'   This zone will not be analyzed: {zone}')
         
     # TEST 2: Open log & calculate winners
@@ -8,12 +8,15 @@
 #   This code simply extract links from string or from local file.
 #   Run on the shell "python url_scraper.py path_to_txt.txt" to scrape urls on 
 #   a  local txt.
+#   Big files (e.g. chat exports of hundreds of MB) are memory-mapped and
+#   scanned lazily: report codes are yielded (once) as soon as they are found,
+#   so that logs can be fetched while the scan is still running.
 #
 # -----------------------------------------------------------------------------
 
 
 ### IMPORTING
-import re, sys, os
+import re, sys, os, mmap
 
 
 ### GLOBALS
@@ -22,18 +25,79 @@ SW_DIR=os.path.dirname(MODULE_DIR)
 LOGS_DIR=os.path.join(SW_DIR,'logs')
 TXT_DIR=os.path.join(SW_DIR,'txt')
 
+# Patterns
+ESOLOGS_REPORTS_URL = 'https://www.esologs.com/reports/'
+# ESOLOGS_URL_PATTERN = r'https://www\.esologs\.com/reports/[a-zA-Z0-9]{16}'
+ESOLOGS_URL_PATTERN = re.compile(r'esologs\.com/reports/([a-zA-Z0-9]{16})')
+ESOLOGS_URL_PATTERN_BYTES = re.compile(ESOLOGS_URL_PATTERN.pattern.encode()) # for files (ASCII only, safe on utf-8)
+MATCH_LENGTH = len('esologs.com/reports/')+16 # all the matches have the same length
+CHUNK_SIZE = 1 << 20 # bytes - read size when a file cannot be memory-mapped
+
 
 ### METHODS
+def get_url_from_code(code:str):
+    return ESOLOGS_REPORTS_URL+code
+
+def iter_esologs_codes_from_str(txt:str):
+    # unique report codes, in order of appearance (anchors as #boss=..&difficulty=.. are dropped)
+    seen = set()
+    for match in ESOLOGS_URL_PATTERN.finditer(txt):
+        code = match.group(1)
+        if code not in seen:
+            seen.add(code)
+            yield code
+
 def extract_esologs_urls_from_str(txt:str):
-    # pattern = r'https://www\.esologs\.com/reports/[a-zA-Z0-9]{16}'
-    pattern = r'esologs\.com/reports/[a-zA-Z0-9]{16}'
-    return ['https://www.'+a for a in re.findall(pattern, txt)]
+    return [get_url_from_code(a) for a in iter_esologs_codes_from_str(txt)]
+
+def iter_esologs_codes_from_buffer(buffer):
+    # scan any bytes-like object (e.g. mmap) without copying it
+    seen = set()
+    for match in ESOLOGS_URL_PATTERN_BYTES.finditer(buffer):
+        code = match.group(1).decode()
+        if code not in seen:
+            seen.add(code)
+            yield code
+
+def iter_esologs_codes_from_stream(stream,chunk_size=CHUNK_SIZE):
+    # scan a binary stream by chunks, keeping the tail of each chunk since a match may be split among two chunks
+    seen = set()
+    tail = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer = tail + chunk
+        # matches starting after cutoff may continue in the next chunk (all of them at the end of the stream)
+        cutoff = len(buffer) if not chunk else max(len(buffer)-MATCH_LENGTH+1,0)
+        next_start = cutoff
+        for match in ESOLOGS_URL_PATTERN_BYTES.finditer(buffer):
+            if match.start() >= cutoff:
+                break
+            next_start = max(next_start,match.end())
+            code = match.group(1).decode()
+            if code not in seen:
+                seen.add(code)
+                yield code
+        if not chunk:
+            return
+        tail = buffer[next_start:]
+
+def iter_esologs_codes_from_local_file(filepath_to_txt,chunk_size=CHUNK_SIZE):
+    with open(filepath_to_txt,'rb') as file:
+        try:
+            buffer = mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ)
+        except (ValueError,OSError): # empty files, pipes, ...
+            yield from iter_esologs_codes_from_stream(file,chunk_size)
+            return
+        with buffer:
+            yield from iter_esologs_codes_from_buffer(buffer)
+
+def iter_esologs_urls_from_local_file(filepath_to_txt):
+    # lazy: give it to fetch_logs so that logs are fetched during the scan
+    for code in iter_esologs_codes_from_local_file(filepath_to_txt):
+        yield get_url_from_code(code)
 
 def extract_esologs_urls_from_local_file(filepath_to_txt):
-    file = open(filepath_to_txt,"r",encoding='utf-8')
-    content = file.read()
-    file.close()
-    return extract_esologs_urls_from_str(content)
+    return list(iter_esologs_urls_from_local_file(filepath_to_txt))
 
 
 ### MAIN
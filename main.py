@@ -12,41 +12,34 @@
 
 ### IMPORTING
 # Standard library imports
-import sys, logging, configparser
-from datetime import datetime
+import sys, logging, configparser, asyncio, functools, threading, itertools, contextvars, datetime
+from concurrent.futures import ThreadPoolExecutor
 from pytz import timezone
 
-# Project library imports
-from esologs.esologs_parser import *
+# Project library imports (light ones only: esologs, database and discord
+# modules are imported by the procedures that need them, see startup_time.py)
 from esologs.url_scraper import *
-from database.database import *
-
-# Third-party library imports
-import nextcord
-from nextcord.ext import commands, tasks
-from nextcord.ui.select import string
+from metrics import METRICS, start_textfile_writer
+from scheduler import INTERACTIVE, request_priority
 
 
 ### GLOBALS
-config = configparser.ConfigParser()
-config.read('config.ini')
-
-# Guild
-DEVELOPER_ID = int(config['GUILD']['DEVELOPER_ID'])
-ADMIN_ID = int(config['GUILD']['ADMIN_ID'])
-LIST_OF_ADMINS = [DEVELOPER_ID,ADMIN_ID]
-SERVER_ID = config['GUILD']['SERVER_ID']
-CHANNEL_ID = config['GUILD']['CHANNEL_ID']
-LINK_TO_CHANNEL = f"https://discord.com/channels/{SERVER_ID}/{CHANNEL_ID}"
-
 # Timezone
 TIMEZONE = timezone('Europe/Rome') # Set for logging
 LOCAL_TIME_NOW = datetime.datetime.now(TIMEZONE).astimezone() # Get tz info for nextcord
 TASK_LOOP_TIME = datetime.time(hour=5, minute=0, tzinfo=LOCAL_TIME_NOW.tzinfo)
 
+# Bot workers (blocking database/esologs jobs run off the event loop)
+BOT_WORKERS = 4
+PROGRESS_EDIT_INTERVAL = 5 # s - between progress messages of /process_logs
+MAX_RANK_SIZE = 25          # rows of /show_rank (discord messages are limited to 2000 chars)
+
+# Batches (bounded memory: the reports of a batch are kept until its commit)
+PROCESS_BATCH_SIZE = 100    # logs fetched, processed and committed together
+BACKFILL_BATCH_SIZE = 100   # logs stored and committed together
+
 # Project
 LINK_TO_README = 'https://github.com/MCilento93/esologs-counter/blob/main/README.md'
-GOOGLESHEET_PUBLIC_URL = config['GOOGLE']['GOOGLESHEET_PUBLIC_URL']
 
 
 ### LOGGER
@@ -62,101 +55,247 @@ logging.basicConfig(filename='logs/logfile.log',
 # Core operations
 def analyze_logs_from_file(filepath):
     # Analyze only url logs stored on a local file
-    urls = extract_esologs_urls_from_local_file(filepath)
-    for url in urls:
-        log = Log(url)
+    from esologs.batch_fetcher import fetch_logs
+    urls = iter_esologs_urls_from_local_file(filepath) # fetching starts during the scan
+    for log in fetch_logs(urls):
         log.calculate_trials_closed()
 
 def load_logs_from_file(filepath):
-    # Store the log in the log database
-    urls = extract_esologs_urls_from_local_file(filepath)
-    for url in urls:
-        log = Log(url)
-        LogDataBase().append_log(   log.datetime_str,       # A - timestamp
-                                    log.title,              # B - title
-                                    log.owner,              # C - owner
-                                    log.code,               # D - code
-                                    log.url,                # E - url
-                                    log.get_attendees().str)# I - attendees
-
-def process_logs_in_db():
+    # Store the log in the log database (stored logs are skipped before fetching)
+    from esologs.batch_fetcher import fetch_logs
+    from database.database import LogDataBase
+    codes = LogDataBase.iter_new_codes(iter_esologs_codes_from_local_file(filepath))
+    urls = (get_url_from_code(a) for a in codes) # fetching starts during the scan
+    LogDataBase().append_logs([(log.datetime_str,       # A - timestamp
+                                log.title,              # B - title
+                                log.owner,              # C - owner
+                                log.code,               # D - code
+                                log.url,                # E - url
+                                log.get_attendees().str)# I - attendees
+                               for log in fetch_logs(urls)])
+
+def process_logs_in_db(progress=None,batch_size=PROCESS_BATCH_SIZE):
+    """
+    progress(stage, done, total, api_calls), if given, is called while the logs
+    are fetched ('fetching') and calculated ('processing').
+    Logs are committed (rank written, then logs marked as processed) every
+    batch_size logs (PROCESS_BATCH_SIZE by default). An interrupted commit is completed
+    first, so that no log is counted twice.
+    """
+    from esologs.batch_fetcher import fetch_logs_with_retries, get_default_client
+    from database.database import LogDataBase, RankDataBase, recover_processing
+    recover_processing()
     # Get urls not processed yet
     urls = LogDataBase().get_unprocessed_logs()
     if urls == []:
         logger.info('All logs in the database have already been processed')
         return 'all-logs-already-processed'
-    for url in urls:
-    # Calculate logs information
-        log = Log(url)
-        log.calculate_trials_closed()
-        rank_db=RankDataBase()
-        for trial_closed in log.trials_closed.list:
-    # Update RankDataBase
-            rank_db.update(trial_closed.usernames_list_of_str,trial_closed.name,log.datetime_str)
-    # Update number of attendances
-        rank_db.update_attendees(log.attendees.list_of_str,log.trials_closed.num)
-    # Update LogDataBase
-        LogDataBase().mark_processed_log(log.url,log.status,log.trials_closed.str)
+    client = get_default_client()
+    num_requests_start = client.num_requests
+    def report(stage,done):
+        if progress:
+            progress(stage,done,len(urls),client.num_requests-num_requests_start)
+    num_fetched = 0
+    fetch_lock = threading.Lock()
+    def on_fetched(log): # called from the fetching threads
+        nonlocal num_fetched
+        with fetch_lock:
+            num_fetched += 1
+            report('fetching',num_fetched)
+    batch_size = batch_size or PROCESS_BATCH_SIZE
+    num_processed = 0
+    num_not_available = 0
+    for start in range(0,len(urls),batch_size):
+        with METRICS.timer('fetch'):
+            logs = fetch_logs_with_retries(urls[start:start+batch_size],client=client,callback=on_fetched)
+        rank_session = RankDataBase().start_session() # rank read once (after fetching), written at the end of the batch
+        with METRICS.timer('process'):
+            for log in logs:
+                if log.is_retryable: # left unprocessed, fetched again by the next run
+                    logger.warning(f'  Log {log.url} not available now ({log.status}), left unprocessed')
+                    num_not_available += 1
+                    continue
+            # Calculate logs information
+                log.calculate_trials_closed()
+                for trial_closed in log.trials_closed.list:
+            # Update RankDataBase
+                    rank_session.update(trial_closed.usernames_list_of_str,trial_closed.name,log.datetime_str)
+            # Update number of attendances
+                rank_session.update_attendees(log.attendees.list_of_str,log.trials_closed.num)
+                num_processed += 1
+                report('processing',num_processed)
+        # Update RankDataBase and LogDataBase (journaled)
+        with METRICS.timer('commit'):
+            rank_session.commit([(log.url,log.status,log.trials_closed.str) for log in logs if not log.is_retryable])
+        METRICS.inc('logs_processed_total',len(logs))
+    if num_not_available:
+        return f'procesed {len(urls)-num_not_available} new logs, {num_not_available} not available now (retry later)'
     return f'procesed {len(urls)} new logs' 
 
+def backfill(filepath,batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Load and process all the logs of a (big) file, e.g. the guild history.
+    Every batch is stored and committed before the next one, with the progress
+    saved in a checkpoint: after a crash, a Ctrl-C or an exhausted quota run it
+    again to resume. Logs not available (quota, timeout, connection) are
+    fetched again a few times, then they stop the backfill: they are not
+    stored (or left unprocessed) and fetched again when resuming. Stored logs are skipped without any call and interrupted
+    commits are completed, so nothing is counted twice.
+    """
+    from esologs.batch_fetcher import fetch_logs_with_retries
+    from database.database import LogDataBase, Checkpoint
+    checkpoint = Checkpoint('backfill')
+    state = checkpoint.load() or {}
+    if state.get('filepath') == filepath:
+        logger.info(f"  Resuming backfill of {filepath} ({state['loaded']} logs loaded, {state['processed']} processed)")
+    else:
+        state = {'filepath':filepath,'loaded':0,'processed':0}
+    log_db = LogDataBase()
+    def count_processed(): # logs loaded by the backfill and not left unprocessed
+        num_unprocessed = len(LogDataBase().get_unprocessed_logs())
+        return max(0,state['loaded']-num_unprocessed), num_unprocessed
+    process_logs_in_db(batch_size=batch_size) # logs left unprocessed by the previous runs
+    state['processed'], num_unprocessed = count_processed()
+    codes = LogDataBase.iter_new_codes(iter_esologs_codes_from_local_file(filepath))
+    urls = (get_url_from_code(a) for a in codes)
+    while True:
+        batch = list(itertools.islice(urls,batch_size))
+        if not batch:
+            break
+        logs = fetch_logs_with_retries(batch) # at the rate of the shared esologs budget
+        failed = [log for log in logs if log.is_retryable] # not stored, fetched again when resuming
+        log_db.append_logs([(log.datetime_str,       # A - timestamp
+                             log.title,              # B - title
+                             log.owner,              # C - owner
+                             log.code,               # D - code
+                             log.url,                # E - url
+                             log.get_attendees().str)# I - attendees
+                            for log in logs if not log.is_retryable])
+        state['loaded'] += len(logs)-len(failed)
+        checkpoint.save(state)
+        process_logs_in_db(batch_size=batch_size)
+        state['processed'], num_unprocessed = count_processed() # logs left for the same reasons
+        checkpoint.save(state)
+        logger.info(f"  Backfill: {state['loaded']} logs loaded, {state['processed']} processed")
+        if failed or num_unprocessed:
+            logger.warning(f'  Backfill stopped, {len(failed)+num_unprocessed} logs not available now (quota, timeout or connection)')
+            return f"backfill stopped ({state['loaded']} logs loaded, {state['processed']} processed): esologs not available now, run it again to resume"
+    checkpoint.clear()
+    return f"backfill completed ({state['loaded']} logs loaded, {state['processed']} processed)"
+
+def rebuild_rank():
+    # Rewrite the rank from scratch with all the processed logs of the database
+    from esologs.esologs_parser import Fight
+    from esologs.batch_fetcher import fetch_logs
+    from database.database import LogDataBase, RankDataBase
+    processed_logs = LogDataBase().get_processed_logs()
+    logs = fetch_logs([url for url,status in processed_logs])
+    history = []
+    for log,(url,status) in zip(logs,processed_logs):
+        if not log.is_valid and status != log.status:
+            logger.error(f'  Log {url} not available now ({log.status}), rank not rebuilt')
+            return 'log-not-available'
+        log.calculate_trials_closed()
+        history.append((log.datetime_str,
+                        log.attendees.list_of_str,
+                        [(a.name,a.usernames_list_of_str) for a in log.trials_closed.list]))
+    RankDataBase().rebuild(history,trial_columns=Fight.get_all_names())
+    return f'rank rebuilt from {len(history)} logs'
+
+def flush_database():
+    # push the local writes to the google sheet mirror now, so they are online at the end of the procedure
+    from database.database import flush_mirror
+    flush_mirror()
+
 # Discord bot
-intents = nextcord.Intents(messages=True, guilds=True)
-intents.message_content = True
-bot = commands.Bot(intents=intents)
-
-async def has_permissions(interaction):
-    permission_bool = False
-    # Check if the bot has the necessary permissions in the channel
-    if type(interaction.channel) == nextcord.PartialMessageable:
+def build_bot(config):
+    # Bot, workers and handlers (discord, pandas and table2ascii are loaded only here)
+    import nextcord
+    from nextcord.ext import commands, tasks
+    from table2ascii import table2ascii as t2a, PresetStyle
+    from esologs.batch_fetcher import fetch_logs_async
+    from database.database import LogDataBase, RankDataBase
+
+    # Guild
+    DEVELOPER_ID = int(config['GUILD']['DEVELOPER_ID'])
+    ADMIN_ID = int(config['GUILD']['ADMIN_ID'])
+    LIST_OF_ADMINS = [DEVELOPER_ID,ADMIN_ID]
+    SERVER_ID = config['GUILD']['SERVER_ID']
+    CHANNEL_ID = config['GUILD']['CHANNEL_ID']
+    LINK_TO_CHANNEL = f"https://discord.com/channels/{SERVER_ID}/{CHANNEL_ID}"
+    GOOGLESHEET_PUBLIC_URL = config['GOOGLE']['GOOGLESHEET_PUBLIC_URL']
+
+    intents = nextcord.Intents(messages=True, guilds=True)
+    intents.message_content = True
+    bot = commands.Bot(intents=intents)
+    bot_executor = ThreadPoolExecutor(max_workers=BOT_WORKERS,thread_name_prefix='bot-worker')
+    processing_lock = asyncio.Lock() # one /process_logs job at a time
+
+    async def run_in_worker(func,*args,**kwargs):
+        # run blocking jobs (google sheet, esologs batches) without freezing the bot, with the request priority of the caller
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(bot_executor,functools.partial(context.run,func,*args,**kwargs))
+
+    async def has_permissions(interaction):
         permission_bool = False
-    else:
-        permission_bool = interaction.channel.permissions_for(interaction.guild.me).send_messages  # required authorization to send messages
-    if permission_bool is False:
-        await interaction.followup.send("🚫 I'm unable to send messages in this realm. Kindly ask the server's admin and ensure that the 'Send Messages' privilege is given to me and to my honored role in this channel ⚔️🏹")  # followup is webhook, so it can be sent
-        return permission_bool  # bool
+        # Check if the bot has the necessary permissions in the channel
+        if type(interaction.channel) == nextcord.PartialMessageable:
+            permission_bool = False
+        else:
+            permission_bool = interaction.channel.permissions_for(interaction.guild.me).send_messages  # required authorization to send messages
+        if permission_bool is False:
+            await interaction.followup.send("🚫 I'm unable to send messages in this realm. Kindly ask the server's admin and ensure that the 'Send Messages' privilege is given to me and to my honored role in this channel ⚔️🏹")  # followup is webhook, so it can be sent
+            return permission_bool  # bool
     
-@bot.event
-async def on_ready():
-    num_logs = LogDataBase().num_logs
-    print(f"{bot.user} bot is handling {num_logs} logs for Assassin's Souls")
-    print('------------------------------------------------------------------')
-    scheduled_message_routine.start()
-    await bot.change_presence(activity=nextcord.CustomActivity(name=f"""Handling {num_logs} logs for the Assassin's Souls"""))
-
-@bot.event
-async def on_message(message):
-    # Check if private message
-    if isinstance(message.channel,nextcord.DMChannel):
-        logger.info(f'{message.author.name} typed privately: {message.content}')
-        return
+    @bot.event
+    async def on_ready():
+        num_logs = await run_in_worker(lambda: LogDataBase().num_logs)
+        print(f"{bot.user} bot is handling {num_logs} logs for Assassin's Souls")
+        print('------------------------------------------------------------------')
+        scheduled_message_routine.start()
+        await bot.change_presence(activity=nextcord.CustomActivity(name=f"""Handling {num_logs} logs for the Assassin's Souls"""))
+
+    @bot.event
+    async def on_message(message):
+        # Check if private message
+        if isinstance(message.channel,nextcord.DMChannel):
+            logger.info(f'{message.author.name} typed privately: {message.content}')
+            return
     
-    # Check if in the guild's chat
-    if message.guild.id == int(SERVER_ID) and message.channel.id == int(CHANNEL_ID) and message.author != bot.user:
-        logger.info(f"{message.author} typed: {message.content}")
-        urls = extract_esologs_urls_from_str(message.content)
-        if urls:
-            num_urls = len(urls)
-            logger.info('Found valid urls, load_logs procedure started')
-            for url in urls:
-                log = Log(url)
-                LogDataBase().append_log(   log.datetime_str,       # A - timestamp
-                                            log.title,              # B - title
-                                            log.owner,              # C - owner
-                                            log.code,               # D - code
-                                            log.url,                # E - url
-                                            log.get_attendees().str)# I - attendees
-            logs_worksheet_url = GOOGLESHEET_PUBLIC_URL
-            await message.reply(f"""
+        # Check if in the guild's chat
+        if message.guild.id == int(SERVER_ID) and message.channel.id == int(CHANNEL_ID) and message.author != bot.user:
+            logger.info(f"{message.author} typed: {message.content}")
+            codes = list(iter_esologs_codes_from_str(message.content))
+            if codes:
+                with request_priority(INTERACTIVE): # esologs and google requests before the background jobs
+                    new_codes = await run_in_worker(lambda: list(LogDataBase.iter_new_codes(codes)))
+                    if not new_codes:
+                        await message.reply(f"👌 Log(s) already stored in the [logs-database]({GOOGLESHEET_PUBLIC_URL}), thank you {message.author}",suppress_embeds=True)
+                        return
+                    urls = [get_url_from_code(a) for a in new_codes]
+                    logger.info('Found valid urls, load_logs procedure started')
+                    logs = await fetch_logs_async(urls)
+                    rows = [(log.datetime_str,       # A - timestamp
+                             log.title,              # B - title
+                             log.owner,              # C - owner
+                             log.code,               # D - code
+                             log.url,                # E - url
+                             log.get_attendees().str)# I - attendees
+                            for log in logs]
+                    await run_in_worker(lambda: LogDataBase().append_logs(rows))
+                    logs_worksheet_url = GOOGLESHEET_PUBLIC_URL
+                    await message.reply(f"""
 Valid log(s) found! Thank you {message.author} 🙏🏻
 I have updated the [logs-database]({logs_worksheet_url}) 💾
 """,suppress_embeds=True)
 
-@bot.slash_command(name='help', description="Get help on how I may help you")
-async def help(interaction: nextcord.Interaction):
-    await interaction.response.defer()
-    logger.info(f'{interaction.user.name} invoked /help')
-    rank_worksheet_url = GOOGLESHEET_PUBLIC_URL
-    await interaction.followup.send(f"""
+    @bot.slash_command(name='help', description="Get help on how I may help you")
+    async def help(interaction: nextcord.Interaction):
+        await interaction.response.defer()
+        logger.info(f'{interaction.user.name} invoked /help')
+        rank_worksheet_url = GOOGLESHEET_PUBLIC_URL
+        await interaction.followup.send(f"""
 👋 Greetings! I'm *{bot.user}* bot, here to account trials attendances in the guild analyzing [esologs.com](https://www.esologs.com/) urls!
 Click [here]({LINK_TO_README}) for my README 📜 and [here]({rank_worksheet_url}) to access the most updated rank 🧮 of the attendees.
 
@@ -168,65 +307,116 @@ My role is to keep track of all trials in the chat {LINK_TO_CHANNEL}. My slash c
 Stay ahead with the rank. Happy gaming! ⚔️👑🏹
 """,suppress_embeds=True)
 
-@bot.slash_command(name='show_rank',description='Print updated rank of the guild')
-async def show_rank(interaction: nextcord.Interaction):
-    await interaction.response.defer()
-    logger.info(f'{interaction.user.name} invoked /show_rank')
-
-    # Check Permissions
-    permission_bool = await has_permissions(interaction)
-    if permission_bool is False:
-        return
-
-    # Get table from database
-    table_ascii = RankDataBase().get_ascii_table()
-    rank_worksheet_url = GOOGLESHEET_PUBLIC_URL
-
-    # Send reply
-    if table_ascii:
-        await interaction.followup.send(f"**Updated rank of the trials 🏆**```\n{table_ascii}\n```\n🧮 Click [here]({rank_worksheet_url}) for full data",suppress_embeds=True)
-    else:
-        logger.error('Empty *rank* database ... null data fetched in /show_rank slash command')
-        await interaction.followup.send(f"🙇‍♀️ Rank is empty, check [database]({rank_worksheet_url}) and inform admins")
-
-@bot.slash_command(name='process_logs',description='Calculate unprocessed logs from database')
-async def process_logs(interaction: nextcord.Interaction):
-    await interaction.response.defer()
-    logger.info(f'{interaction.user.name} invoked /process_logs')
-
-    # Check Permissions
-    permission_bool = await has_permissions(interaction)
-    if permission_bool is False:
-        return
-
-    # Update rank database
-    if interaction.user.id in LIST_OF_ADMINS:
-        message = f'  process_logs_in_db() starting ...'
-        print(message)
-        logger.info(message)
-        response = process_logs_in_db()
-        if response == 'all-logs-already-processed':
-            await interaction.followup.send('👌 All logs have already been processed')
+    @bot.slash_command(name='show_rank',description='Print updated rank of the guild')
+    async def show_rank(interaction: nextcord.Interaction,
+                        top: int = nextcord.SlashOption(description='Number of attendees to show',
+                                                        required=False,default=10,min_value=1,max_value=MAX_RANK_SIZE)):
+        await interaction.response.defer()
+        logger.info(f'{interaction.user.name} invoked /show_rank')
+
+        # Check Permissions
+        permission_bool = await has_permissions(interaction)
+        if permission_bool is False:
+            return
+
+        # Get table from database
+        with request_priority(INTERACTIVE):
+            table_ascii = await run_in_worker(lambda: RankDataBase().get_ascii_table(top_k=top))
+        rank_worksheet_url = GOOGLESHEET_PUBLIC_URL
+
+        # Send reply
+        if table_ascii:
+            await interaction.followup.send(f"**Updated rank of the trials 🏆**```\n{table_ascii}\n```\n🧮 Click [here]({rank_worksheet_url}) for full data",suppress_embeds=True)
         else:
-            await interaction.followup.send(f"✅ Rank updated")
-    else:
-        await interaction.followup.send(f"🚫 You don't have permissions for update the rank")
-        logger.error('  Something went wrong. Check logs')
-    return
-
-@tasks.loop(time=TASK_LOOP_TIME)
-async def scheduled_message_routine():
-    print('\nDaily routine for esologs-counter bot...')
-
-    # Update presence
-    num_logs = LogDataBase().num_logs
-    await bot.change_presence(activity=nextcord.CustomActivity(name=f"""Handling {num_logs} logs for the Assassin's Souls"""))
+            logger.error('Empty *rank* database ... null data fetched in /show_rank slash command')
+            await interaction.followup.send(f"🙇‍♀️ Rank is empty, check [database]({rank_worksheet_url}) and inform admins")
+
+    @bot.slash_command(name='process_logs',description='Calculate unprocessed logs from database')
+    async def process_logs(interaction: nextcord.Interaction):
+        await interaction.response.defer()
+        logger.info(f'{interaction.user.name} invoked /process_logs')
+
+        # Check Permissions
+        permission_bool = await has_permissions(interaction)
+        if permission_bool is False:
+            return
+
+        # Update rank database
+        if interaction.user.id in LIST_OF_ADMINS:
+            if processing_lock.locked():
+                await interaction.followup.send('⏳ Logs are already being processed, wait for the end of the current job')
+                return
+            async with processing_lock:
+                message = f'  process_logs_in_db() starting ...'
+                print(message)
+                logger.info(message)
+                progress_message = await interaction.followup.send('⚙️ Processing logs ...',wait=True)
+                progress = {}
+                def on_progress(stage,done,total,api_calls): # called from the worker thread
+                    progress.update(stage=stage,done=done,total=total,api_calls=api_calls)
+                job = asyncio.ensure_future(run_in_worker(process_logs_in_db,progress=on_progress))
+                while not job.done():
+                    await asyncio.wait({job},timeout=PROGRESS_EDIT_INTERVAL)
+                    if progress and not job.done():
+                        await progress_message.edit(content=f"⚙️ {progress['stage'].capitalize()} logs: {progress['done']}/{progress['total']} (esologs API calls: {progress['api_calls']})")
+                try:
+                    response = job.result()
+                except Exception:
+                    logger.exception('  process_logs_in_db() failed')
+                    await progress_message.edit(content='❌ Something went wrong while processing the logs, check logs')
+                    return
+            if response == 'all-logs-already-processed':
+                await progress_message.edit(content='👌 All logs have already been processed')
+            else:
+                await progress_message.edit(content=f"✅ Rank updated ({response})")
+                await run_in_worker(lambda: RankDataBase().get_ascii_table()) # pre-render /show_rank
+        else:
+            await interaction.followup.send(f"🚫 You don't have permissions for update the rank")
+            logger.error('  Something went wrong. Check logs')
+        return
 
+    @bot.slash_command(name='stats',description='Show API usage and timings of the bot (admins only)')
+    async def stats(interaction: nextcord.Interaction):
+        await interaction.response.defer()
+        logger.info(f'{interaction.user.name} invoked /stats')
+
+        # Check Permissions
+        permission_bool = await has_permissions(interaction)
+        if permission_bool is False:
+            return
+        if interaction.user.id not in LIST_OF_ADMINS:
+            await interaction.followup.send(f"🚫 You don't have permissions for the stats")
+            return
+
+        # Tables of requests, procedures and quotas
+        budgets = ', '.join(f"{api} {METRICS.get_remaining_budget(api)}/{limit} in {window//60} min"
+                            for api,(limit,window) in METRICS.budgets.items())
+        content = f"**Bot stats 📊**\nRemaining quotas: {budgets}"
+        rows = METRICS.get_summary()
+        if rows:
+            table = t2a(header=['api','op','total','1 min','1 h','p95 ms','err','retry'],body=rows,style=PresetStyle.thin_compact)
+            content += f"```\n{table}\n```"
+        stage_rows = METRICS.get_stage_summary()
+        if stage_rows:
+            table = t2a(header=['stage','runs','last s','mean s'],body=stage_rows,style=PresetStyle.thin_compact)
+            content += f"```\n{table}\n```"
+        await interaction.followup.send(content[:2000])
+
+    @tasks.loop(time=TASK_LOOP_TIME)
+    async def scheduled_message_routine():
+        print('\nDaily routine for esologs-counter bot...')
+
+        # Update presence
+        num_logs = await run_in_worker(lambda: LogDataBase().num_logs)
+        await bot.change_presence(activity=nextcord.CustomActivity(name=f"""Handling {num_logs} logs for the Assassin's Souls"""))
+
+    return bot
 
 ### MAIN 
 if __name__ == '__main__':
 
     args = sys.argv
+    start_textfile_writer() # metrics for the node exporter, if configured
     if len(args) == 1:
         print('No arguments given, run properly the software')
     # RUN PROCEDURE 1: analize locally the logs from local file (without saving results)
@@ -242,15 +432,35 @@ if __name__ == '__main__':
         logger.info('*** RUN PROCEDURE: Load logs from local file')
         filepath = args[2]
         load_logs_from_file(filepath)
+        flush_database()
         logger.info('*** END OF load_logs_from_file PROCEDURE')
     # RUN PROCEDURE 3: analize remote logs and update rank database
     elif args[1] == 'process_logs':
         logger.info('')
         logger.info('*** RUN PROCEDURE: Process logs stored on the database')
         process_logs_in_db()
+        flush_database()
         logger.info('*** END OF process_logs PROCEDURE')
+    # RUN PROCEDURE 4: rebuild the rank database from all the processed logs
+    elif args[1] == 'rebuild_rank':
+        logger.info('')
+        logger.info('*** RUN PROCEDURE: Rebuild rank from processed logs')
+        rebuild_rank()
+        flush_database()
+        logger.info('*** END OF rebuild_rank PROCEDURE')
+    # RUN PROCEDURE 5: load and process (resumable) all the logs of a big local file
+    elif args[1] == 'backfill':
+        logger.info('')
+        logger.info('*** RUN PROCEDURE: Backfill logs from local file')
+        try:
+            print(backfill(args[2]))
+        except KeyboardInterrupt:
+            logger.warning('  Backfill interrupted, run it again to resume')
+            print('Backfill interrupted, run it again to resume')
+        flush_database()
+        logger.info('*** END OF backfill PROCEDURE')
     elif args[1] == 'discord':
-    # RUN PROCEDURE 4: main with discord bot
+    # RUN PROCEDURE 6: main with discord bot
         logger.info('')
         logger.info('*** RUN PROCEDURE: Discord bot')
         logger_discord = logging.getLogger('nextcord') # setup parallel log for nextcord
@@ -259,6 +469,9 @@ if __name__ == '__main__':
         handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-8s @%(name)-23s: %(message)s',
                                                '%Y/%m/%d %H:%M'))
         logger_discord.addHandler(handler)
+        config = configparser.ConfigParser()
+        config.read('config.ini')
+        bot = build_bot(config)
         try:
             bot.run(config['DISCORD']['TOKEN'])
         except (KeyboardInterrupt,RuntimeError):
@@ -0,0 +1,218 @@
+# -----------------------------------------------------------------------------
+# Copyright (C) 2024 - M. Cilento
+#
+# Title: Metrics of the esologs-counter
+# Date of creation: oct-2026
+#
+# Description:
+#   Process-wide counters and latency histograms of the esologs requests, of
+#   the google sheet helpers and of the stages of the logs processing, with
+#   rolling windows to follow the API quotas (esologs 3600 requests/h, google
+#   60 requests/min). Shown by the /stats discord command and written
+#   periodically in the Prometheus text format (node exporter textfile
+#   collector), if METRICS.TEXTFILE_PATH is set in config.ini.
+#
+# -----------------------------------------------------------------------------
+
+
+### IMPORTING
+import os, time, threading, configparser, logging, atexit
+from collections import deque
+from contextlib import contextmanager
+
+
+### GLOBALS
+# Directories
+MODULE_DIR = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+SW_DIR=MODULE_DIR
+
+# Config file
+config = configparser.ConfigParser()
+config.read(os.path.join(SW_DIR,'config.ini'))
+
+# API quotas: api -> (requests, window in s)
+BUDGETS = {'esologs': (config.getint('ESOLOGS','RATE_LIMIT_PER_HOUR',fallback=3600),3600),
+           'sheets': (60,60)}
+
+# Histograms
+LATENCY_BUCKETS = (0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60) # s
+ROLLING_WINDOWS = (60,3600) # s - of the /stats summary
+MAX_RECENT = 20000          # samples kept for the rolling windows
+
+# Prometheus text file
+PREFIX = 'esologs_counter_'
+TEXTFILE_PATH = config.get('METRICS','TEXTFILE_PATH',fallback='')
+TEXTFILE_INTERVAL = config.getfloat('METRICS','TEXTFILE_INTERVAL',fallback=15) # s
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+### CLASSES
+class Histogram:
+
+    def __init__(self,buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0]*len(buckets)
+        self.count = 0
+        self.sum = 0.
+        self.recent = deque(maxlen=MAX_RECENT) # (timestamp, value)
+
+    def observe(self,value,now):
+        self.count += 1
+        self.sum += value
+        for i,bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+        self.recent.append((now,value))
+
+class Metrics:
+
+    def __init__(self,budgets=BUDGETS):
+        self.lock = threading.Lock()
+        self.counters = {}      # (name, labels) -> value
+        self.histograms = {}    # (name, labels) -> Histogram
+        self.budgets = budgets
+        self.calls = {api:deque() for api in budgets} # timestamps of the calls in the budget window
+
+    @staticmethod
+    def get_key(name,labels):
+        return (name,tuple(sorted(labels.items())))
+
+    def inc(self,name,value=1,**labels):
+        key = Metrics.get_key(name,labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key,0) + value
+
+    def observe(self,name,value,**labels):
+        key = Metrics.get_key(name,labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value,time.monotonic())
+
+    def count_call(self,api):
+        # call toward the quota of the api
+        if api in self.calls:
+            with self.lock:
+                self.calls[api].append(time.monotonic())
+
+    def get_remaining_budget(self,api):
+        limit, window = self.budgets[api]
+        now = time.monotonic()
+        with self.lock:
+            calls = self.calls[api]
+            while calls and now-calls[0] > window:
+                calls.popleft()
+            return limit-len(calls)
+
+    @contextmanager
+    def track(self,api,op):
+        """
+        Time an API call: count, latency and outcome ('ok', 'error' if an
+        exception is raised, or set by the caller, e.g. 'http_429').
+        """
+        call = {'outcome':'ok'}
+        self.count_call(api)
+        start = time.perf_counter()
+        try:
+            yield call
+        except BaseException:
+            call['outcome'] = 'error'
+            raise
+        finally:
+            self.observe('request_seconds',time.perf_counter()-start,api=api,op=op)
+            self.inc('requests_total',api=api,op=op,outcome=call['outcome'])
+
+    @contextmanager
+    def timer(self,stage):
+        # duration of a stage of the procedures (e.g. fetch, process, commit)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds',time.perf_counter()-start,stage=stage)
+
+    def count_retry(self,details):
+        # on_backoff handler of the backoff decorators
+        self.inc('retries_total',op=details['target'].__name__)
+
+    def get_summary(self):
+        # rows (api, op, total, last minute, last hour, p95 ms last hour, errors, retries) for /stats
+        now = time.monotonic()
+        rows = []
+        with self.lock:
+            for (name,labels),histogram in sorted(self.histograms.items()):
+                if name != 'request_seconds':
+                    continue
+                api, op = dict(labels)['api'], dict(labels)['op']
+                recent = [(now-timestamp,value) for timestamp,value in histogram.recent if now-timestamp <= ROLLING_WINDOWS[1]]
+                last_minute = sum(1 for age,value in recent if age <= ROLLING_WINDOWS[0])
+                latencies = sorted(value for age,value in recent)
+                p95 = latencies[int(0.95*(len(latencies)-1))]*1e3 if latencies else 0.
+                errors = sum(value for (a,b),value in self.counters.items() if a == 'requests_total'
+                             and dict(b)['api'] == api and dict(b)['op'] == op and dict(b)['outcome'] != 'ok')
+                retries = self.counters.get(Metrics.get_key('retries_total',{'op':op}),0)
+                rows.append([api,op,histogram.count,last_minute,len(recent),round(p95),errors,retries])
+        return rows
+
+    def get_stage_summary(self):
+        # rows (stage, runs, last s, mean s) for /stats
+        with self.lock:
+            return [[dict(labels)['stage'],histogram.count,round(histogram.recent[-1][1],2),round(histogram.sum/histogram.count,2)]
+                    for (name,labels),histogram in sorted(self.histograms.items()) if name == 'stage_seconds']
+
+    def to_prometheus(self):
+        lines = []
+        def format_labels(labels,**extra):
+            labels = dict(labels,**extra)
+            return '{'+','.join(f'{a}="{b}"' for a,b in labels.items())+'}' if labels else ''
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        for name in sorted(set(a[0][0] for a in counters)):
+            lines.append(f'# TYPE {PREFIX}{name} counter')
+            lines += [f'{PREFIX}{name}{format_labels(labels)} {value}' for (a,labels),value in counters if a == name]
+        for name in sorted(set(a[0][0] for a in histograms)):
+            lines.append(f'# TYPE {PREFIX}{name} histogram')
+            for (a,labels),histogram in histograms:
+                if a != name:
+                    continue
+                for bound,count in zip(histogram.buckets,histogram.bucket_counts):
+                    lines.append(f'{PREFIX}{name}_bucket{format_labels(labels,le=bound)} {count}')
+                lines.append(f'{PREFIX}{name}_bucket{format_labels(labels,le="+Inf")} {histogram.count}')
+                lines.append(f'{PREFIX}{name}_sum{format_labels(labels)} {histogram.sum}')
+                lines.append(f'{PREFIX}{name}_count{format_labels(labels)} {histogram.count}')
+        lines.append(f'# TYPE {PREFIX}budget_remaining gauge')
+        for api,(limit,window) in self.budgets.items():
+            lines.append(f'{PREFIX}budget_remaining{format_labels({"api":api,"window":window})} {self.get_remaining_budget(api)}')
+        return '\n'.join(lines)+'\n'
+
+    def write_textfile(self,path=TEXTFILE_PATH):
+        # atomic, the node exporter never reads half-written files
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path,'w',encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path,path)
+
+
+### METHODS
+METRICS = Metrics() # process-wide
+
+_textfile_thread = None
+
+def start_textfile_writer(path=TEXTFILE_PATH,interval=TEXTFILE_INTERVAL):
+    # write the metrics every interval seconds (and at exit), if a path is configured
+    global _textfile_thread
+    if not path or _textfile_thread is not None:
+        return
+    def run():
+        while True:
+            try:
+                METRICS.write_textfile(path)
+            except OSError:
+                logger.exception(f'  Metrics not written in {path}')
+            time.sleep(interval)
+    _textfile_thread = threading.Thread(target=run,name='metrics-textfile',daemon=True)
+    _textfile_thread.start()
+    atexit.register(lambda: METRICS.write_textfile(path))
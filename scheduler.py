@@ -0,0 +1,144 @@
+# -----------------------------------------------------------------------------
+# Copyright (C) 2024 - M. Cilento
+#
+# Title: Quota scheduler of the APIs
+# Date of creation: oct-2026
+#
+# Description:
+#   One QuotaScheduler per API (esologs, google sheet): every request takes a
+#   slot from it before being sent. Slots are limited both by a token bucket
+#   (smooth rate, small bursts) and by the quota of the API over its rolling
+#   window (e.g. 60 requests/min for google).
+#   Requests have a priority: interactive ones (discord messages, /show_rank)
+#   are served first, while background ones (process_logs, backfill, mirror)
+#   leave a share of the quota free and wait for the interactive requests
+#   queued, so long jobs slow down early instead of hitting 429 errors.
+#   The priority is set by the caller with request_priority(INTERACTIVE) and
+#   is a context variable: asyncio tasks inherit it, thread pools must run
+#   their jobs in a copy of the context (see fetch_logs, run_in_worker).
+#
+# -----------------------------------------------------------------------------
+
+
+### IMPORTING
+import time, threading, asyncio, contextvars, logging
+from collections import deque
+from contextlib import contextmanager
+from metrics import METRICS
+
+
+### GLOBALS
+# Priorities
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+_priority = contextvars.ContextVar('priority',default=BACKGROUND)
+
+# Admission control
+INTERACTIVE_RESERVE = 0.2   # share of the quota that background requests leave free
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+### CLASSES
+class QuotaScheduler:
+
+    def __init__(self,name,limit,window,capacity=10,reserve=INTERACTIVE_RESERVE):
+        self.name = name
+        self.limit = limit                      # requests per window
+        self.window = window                    # s
+        self.rate = limit/window                # tokens/s
+        self.capacity = capacity                # burst
+        self.tokens = capacity
+        self.timestamp = time.monotonic()
+        self.reserve = int(limit*reserve)       # requests of the window kept for interactive traffic
+        self.calls = deque()                    # timestamps of the requests in the window
+        self.num_waiting = {INTERACTIVE:0,BACKGROUND:0}
+        self.lock = threading.Condition()
+
+    def try_acquire(self,priority,tokens=1):
+        # take the slots and return 0, or the seconds to wait before trying again (lock held)
+        now = time.monotonic()
+        self.tokens = min(self.capacity,self.tokens+(now-self.timestamp)*self.rate)
+        self.timestamp = now
+        while self.calls and now-self.calls[0] >= self.window:
+            self.calls.popleft()
+        if priority == INTERACTIVE:
+            limit, queued = self.limit, 0
+        else: # leave the reserve and the tokens of the queued interactive requests
+            limit, queued = self.limit-self.reserve, self.num_waiting[INTERACTIVE]
+        wait = 0.
+        if self.tokens < tokens+queued:
+            wait = (tokens+queued-self.tokens)/self.rate
+        num_to_expire = len(self.calls)+tokens-limit
+        if num_to_expire > 0:
+            if num_to_expire <= len(self.calls):
+                wait = max(wait,self.calls[num_to_expire-1]+self.window-now)
+            else:
+                wait = max(wait,self.window)
+        if wait > 0:
+            return wait
+        self.tokens -= tokens
+        self.calls.extend([now]*tokens)
+        return 0.
+
+    def acquire(self,tokens=1,priority=None):
+        # block until the request can be sent, return the seconds waited
+        priority = priority or get_priority()
+        start = time.monotonic()
+        with self.lock:
+            self.num_waiting[priority] += 1
+            try:
+                while True:
+                    wait = self.try_acquire(priority,tokens)
+                    if wait == 0:
+                        break
+                    self.lock.wait(wait)
+            finally:
+                self.num_waiting[priority] -= 1
+        return self.waited(start,priority)
+
+    async def acquire_async(self,tokens=1,priority=None):
+        # awaitable acquire, the event loop is never blocked
+        priority = priority or get_priority()
+        start = time.monotonic()
+        with self.lock:
+            self.num_waiting[priority] += 1
+        try:
+            while True:
+                with self.lock:
+                    wait = self.try_acquire(priority,tokens)
+                if wait == 0:
+                    break
+                await asyncio.sleep(wait)
+        finally:
+            with self.lock:
+                self.num_waiting[priority] -= 1
+        return self.waited(start,priority)
+
+    def waited(self,start,priority):
+        waited = time.monotonic()-start
+        if waited > 0.001:
+            logger.debug(f'  {self.name} quota: {priority} request waited {waited:.2f} s')
+            METRICS.observe('scheduler_wait_seconds',waited,api=self.name,priority=priority)
+        return waited
+
+    def get_remaining(self):
+        # requests still available in the current window
+        with self.lock:
+            now = time.monotonic()
+            return self.limit-sum(1 for a in self.calls if now-a < self.window)
+
+
+### METHODS
+def get_priority():
+    return _priority.get()
+
+@contextmanager
+def request_priority(level):
+    # requests sent in this block (and in the threads/tasks started from it) have the given priority
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)